@@ -0,0 +1,117 @@
+"""Create several outputs while only reading the input tables once
+
+Example job file (YAML; JSON with the same structure also works):
+    concept_csv_path: concept.csv
+    concept_relationship_csv_path: concept_relationship.csv
+    outdir: output
+    jobs:
+      - output_type: merged
+      - output_type: rxnorm
+      - output_type: merged
+        vocabs: [SNOMED]
+        relationships: [Is a, Maps to]
+
+Top-level settings are shared by all jobs, and each job can override them. Settings use the same names as the long CLI
+options, with underscores.
+"""
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Union
+
+from omop2owl_vocab.omop2owl_vocab import CONCEPT_DTYPES, CONCEPT_RELATIONSHIP_DTYPES, OMOP2OWL_SETTINGS, \
+    REL_MAPS_BY_REL, _combine_relationship_maps, _exclude_singletons, _filter_concept_relationships, \
+    _filter_concepts, _get_omop2owl_kwargs, _get_relationship_degrees, _get_relationship_maps_by_rel, _parse_date, \
+    _read_table, cli_parser, omop2owl
+
+JOB_SETTINGS = OMOP2OWL_SETTINGS + ['output_type']
+
+
+def _load_job_file(path: str) -> Dict[str, Any]:
+    """Load YAML or JSON job file"""
+    with open(path) as f:
+        if path.endswith('.json'):
+            return json.load(f)
+        import yaml
+        return yaml.safe_load(f)
+
+
+def _get_jobs(job_file: str, defaults: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """Get omop2owl() arguments for each job in job file"""
+    settings = _load_job_file(job_file)
+    jobs: List[Dict[str, Any]] = settings.pop('jobs', [])
+    if not jobs:
+        raise ValueError(f'No jobs in batch job file: {job_file}')
+    for job in [settings] + jobs:
+        unknown_settings = [x for x in job if x not in JOB_SETTINGS]
+        if unknown_settings:
+            raise ValueError(f'Unknown settings in batch job file {job_file}: {", ".join(unknown_settings)}')
+    base_settings = vars(cli_parser().parse_args([])) | (defaults or {}) | settings
+    kwargs_list = [_get_omop2owl_kwargs(base_settings | job) for job in jobs]
+    for kwargs in kwargs_list:
+        for k in ['vocabs', 'relationships']:
+            if isinstance(kwargs[k], str):
+                kwargs[k] = [kwargs[k]]
+        kwargs['vocabs'] = kwargs['vocabs'] or []
+    return kwargs_list
+
+
+def run_batch(job_file: str, defaults: Dict[str, Any] = None) -> List[Union[Dict[str, Any], None]]:
+    """Create the outputs of every job in a job file, reading and parsing the input tables only once
+
+    Relationship maps are also only created once, for the union of the relationships of all jobs, and then shared by
+    every job. Jobs with different as_of dates share the parsed tables, but relationship maps are created once per date.
+    :param defaults: Settings used for any that are not set in the job file, e.g. CLI arguments.
+    :returns The omop2owl() report of each job"""
+    jobs = _get_jobs(job_file, defaults)
+    input_paths = {(x['concept_csv_path'], x['concept_relationship_csv_path']) for x in jobs}
+    if len(input_paths) > 1:
+        raise ValueError('All jobs in a batch must use the same concept_csv_path and concept_relationship_csv_path.')
+    concept_csv_path, concept_relationship_csv_path = input_paths.pop()
+    if not concept_csv_path or not concept_relationship_csv_path:
+        raise RuntimeError('Must pass --concept-csv-path and --concept-relationship-csv-path')
+    use_cache = any(x['use_cache'] for x in jobs)
+    as_ofs: List[int] = sorted({_parse_date(x['as_of']) for x in jobs})
+    cache_dir = os.path.abspath(jobs[0]['outdir'])
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Read inputs
+    t_0 = datetime.now()
+    concept_df_all = _read_table(
+        concept_csv_path, CONCEPT_DTYPES, lambda df: df, cache_dir, use_cache, index_col='concept_id')
+    # - If no snapshots, relationships that are currently invalid are never needed
+    concept_rel_df_all = _read_table(
+        concept_relationship_csv_path, CONCEPT_RELATIONSHIP_DTYPES,
+        (lambda df: df) if any(as_ofs) else (lambda df: _filter_concept_relationships(df, set())), cache_dir,
+        use_cache)
+    t_1 = datetime.now()
+    print('Read input tables in', (t_1 - t_0).seconds, 'seconds')
+
+    # Create outputs
+    reports: List[Union[Dict[str, Any], None]] = []
+    for as_of in as_ofs:
+        as_of_jobs = [x for x in jobs if _parse_date(x['as_of']) == as_of]
+        concept_df = _filter_concepts(concept_df_all, as_of=as_of)
+        concept_ids = set(concept_df.index)
+        concept_rel_df = _filter_concept_relationships(concept_rel_df_all, concept_ids, as_of=as_of)
+        relationships = ['ALL'] if any(x['relationships'] == ['ALL'] for x in as_of_jobs) \
+            else sorted({rel for x in as_of_jobs for rel in x['relationships']})
+        t_2a = datetime.now()
+        print('Grouping relationships...')
+        maps_by_rel: REL_MAPS_BY_REL = _get_relationship_maps_by_rel(concept_rel_df, relationships, concept_ids)
+        t_2b = datetime.now()
+        print('Grouped relationships in', (t_2b - t_2a).seconds, 'seconds')
+
+        for job in as_of_jobs:
+            vocabs: List[str] = job['vocabs']
+            job_concept_df = _filter_concepts(concept_df, vocabs)
+            job_concept_ids = set(job_concept_df.index) if vocabs else concept_ids
+            rel_maps = _combine_relationship_maps(
+                maps_by_rel, job['relationships'], job_concept_ids if vocabs else None)
+            if job['exclude_singletons']:
+                job_concept_rel_df = _filter_concept_relationships(concept_rel_df, job_concept_ids, vocabs, as_of) \
+                    if vocabs else concept_rel_df
+                degrees = _get_relationship_degrees(job_concept_rel_df, job['relationships'], job_concept_ids)
+                job_concept_df = _exclude_singletons(job_concept_df, degrees)
+            reports.append(omop2owl(**job, core_objects=(job_concept_df, rel_maps)))
+    return reports
@@ -0,0 +1,92 @@
+"""Checkpoints for resumable runs, and atomic writing of outputs
+
+Every output is first written to a temporary path, and only moved to its final path once complete, so a crash never
+leaves a truncated output that a later run could mistake for a valid one. Each completed stage is recorded in a
+journal, which --resume uses to pick up at the first incomplete stage.
+"""
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+
+def _get_tmp_path(path: str) -> str:
+    """Get temporary path for an output. Keeps the extension, as some tools, e.g. robot, infer the format from it."""
+    stem, ext = os.path.splitext(path)
+    return f'{stem}.tmp{ext}'
+
+
+@contextmanager
+def atomic_output(path: str) -> Iterator[str]:
+    """Yield a temporary path to write an output file or directory to, which is moved to path only if writing succeeds
+
+    Usage:
+        with atomic_output(outpath) as tmp_path:
+            df.to_csv(tmp_path)
+    """
+    tmp_path = _get_tmp_path(path)
+    _remove(tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        _remove(tmp_path)
+        raise
+    if os.path.isdir(tmp_path) and os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def _remove(path: str):
+    """Remove file or directory, if it exists"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class Checkpoints:
+    """Journal of the completed stages of a run
+
+    A stage is only considered done if it was completed by a run with the same settings, and its outputs still exist.
+    Thread-safe, so that concurrently running stages can share a journal.
+    :param path: Path of journal file.
+    :param settings: Settings of the run, e.g. omop2owl() arguments that affect outputs.
+    :param resume: If False, starts a new journal, forgetting stages completed by previous runs."""
+
+    def __init__(self, path: str, settings: Dict[str, Any], resume=False):
+        self.path = path
+        self.settings: Dict[str, Any] = json.loads(json.dumps(settings, default=str))
+        self.completed: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                journal = json.load(f)
+            if journal['settings'] == self.settings:
+                self.completed = journal['completed']
+            else:
+                print(f'Cannot resume, as settings are different than those of the previous run: {path}')
+        self._save()
+
+    def _save(self):
+        """Save journal"""
+        with atomic_output(self.path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump({'settings': self.settings, 'completed': self.completed}, f, indent=2)
+
+    def done(self, stage: str) -> bool:
+        """Whether stage was completed and its outputs still exist"""
+        return stage in self.completed and all(os.path.exists(x) for x in self.completed[stage])
+
+    def complete(self, stage: str, *outputs: str):
+        """Record that stage was completed, creating outputs"""
+        with self._lock:
+            self.completed[stage] = [str(x) for x in outputs]
+            self._save()
+
+    def invalidate(self, stage: str):
+        """Record that stage needs to be redone, e.g. because its inputs were recreated"""
+        with self._lock:
+            if self.completed.pop(stage, None) is not None:
+                self._save()
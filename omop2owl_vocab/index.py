@@ -0,0 +1,203 @@
+"""Compact, memory-mappable lookup index of concepts and their relationships
+
+Lets applications look up concepts, codes, parents, children, and mappings without loading the OWL or SemanticSQL
+outputs. The index is a directory of .npy files, which are memory-mapped when opened, so opening is near instant
+regardless of size, and only the parts that are looked up are read from disk.
+
+Contents:
+- ids.npy: Sorted concept IDs. A concept's position in this array is its "row".
+- {label,code}.{bytes,offsets}.npy: concept_name and concept_code of each row, as UTF-8 bytes concatenated into one
+  array, and the offsets of each row's string in it.
+- vocab.npy: Position of each row's vocabulary_id in meta.json's vocabs.
+- code_order.npy: Rows sorted by (vocabulary, concept_code), for binary searching codes.
+- rel{i}.{fwd,rev}.{indptr,indices}.npy: CSR adjacency of meta.json's predicates[i], by row. indices are concept IDs,
+  which may not be in the index themselves, e.g. mapping targets in vocabularies that were not included. fwd is
+  subject -> object, e.g. child -> parents for rdfs:subClassOf, and rev is object -> subject.
+"""
+import json
+import os
+from itertools import chain
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+PARENT_PREDICATE = 'rdfs:subClassOf'
+MAPPING_PREDICATE = 'omoprel:Maps_to'
+INDEX_VERSION = 1
+
+
+def _save_strings(outdir: str, name: str, series: 'pd.Series'):
+    """Save strings as concatenated UTF-8 bytes and their offsets"""
+    import numpy as np
+    encoded = [x.encode('utf-8') for x in series]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in encoded], out=offsets[1:])
+    np.save(os.path.join(outdir, f'{name}.bytes.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(outdir, f'{name}.offsets.npy'), offsets)
+
+
+def _get_edges(rel_map: Dict[str, List[str]]) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Get subject and object concept IDs of each edge in a relationship map"""
+    import numpy as np
+    src = np.repeat(np.array(list(rel_map.keys()), dtype=np.int64), [len(v) for v in rel_map.values()])
+    dst = np.array(list(chain.from_iterable(rel_map.values())), dtype=np.int64)
+    return src, dst
+
+
+def _get_csr(ids: 'np.ndarray', src: 'np.ndarray', dst: 'np.ndarray') -> Tuple['np.ndarray', 'np.ndarray']:
+    """Get CSR adjacency (indptr, indices) of edges by row of src in sorted ids. Drops edges whose src is not in ids."""
+    import numpy as np
+    rows = np.searchsorted(ids, src)
+    keep = rows < len(ids)
+    keep[keep] = ids[rows[keep]] == src[keep]
+    rows, dst = rows[keep], dst[keep]
+    order = np.lexsort((dst, rows))
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(ids)), out=indptr[1:])
+    return indptr, dst[order]
+
+
+def _save_csr(outdir: str, name: str, ids: 'np.ndarray', src: 'np.ndarray', dst: 'np.ndarray'):
+    """Save CSR adjacency of edges"""
+    import numpy as np
+    indptr, indices = _get_csr(ids, src, dst)
+    np.save(os.path.join(outdir, f'{name}.indptr.npy'), indptr)
+    np.save(os.path.join(outdir, f'{name}.indices.npy'), indices)
+
+
+def write_index(concept_df: 'pd.DataFrame', rel_maps: Dict[str, Dict[str, List[str]]], outdir: str):
+    """Write lookup index of concepts and relationships
+
+    :param concept_df: Concept table, indexed by concept_id.
+    :param rel_maps: Relationship maps, as created by _get_core_objects()."""
+    import numpy as np
+    import pandas as pd
+    os.makedirs(outdir, exist_ok=True)
+    ids = concept_df.index.to_numpy(dtype=np.int64)
+    order = np.argsort(ids, kind='stable')
+    ids = ids[order]
+    concept_df = concept_df.iloc[order]
+    np.save(os.path.join(outdir, 'ids.npy'), ids)
+    _save_strings(outdir, 'label', concept_df.concept_name)
+    _save_strings(outdir, 'code', concept_df.concept_code)
+    vocab_rows, vocabs = pd.factorize(concept_df.vocabulary_id, sort=True)
+    np.save(os.path.join(outdir, 'vocab.npy'), vocab_rows.astype(np.int32))
+    code_order = pd.DataFrame({'vocab': vocab_rows, 'code': concept_df.concept_code.to_numpy(dtype=object)})\
+        .sort_values(['vocab', 'code'], kind='stable').index.to_numpy(dtype=np.int64)
+    np.save(os.path.join(outdir, 'code_order.npy'), code_order)
+
+    predicates = list(rel_maps.keys())
+    for i, pred in enumerate(predicates):
+        src, dst = _get_edges(rel_maps[pred])
+        _save_csr(outdir, f'rel{i}.fwd', ids, src, dst)
+        _save_csr(outdir, f'rel{i}.rev', ids, dst, src)
+
+    with open(os.path.join(outdir, 'meta.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'vocabs': list(vocabs), 'predicates': predicates}, f, indent=2)
+
+
+class OmopIndex:
+    """Lookups over an index created by write_index()
+
+    Usage:
+        index = OmopIndex('OMOP.index')
+        index.concept(8715)
+        index.lookup_code('SNOMED', '32485007')
+        index.parents(8715)
+    """
+
+    def __init__(self, path: str):
+        import numpy as np
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f'Unsupported index version {meta["version"]}. Recreate the index: {path}')
+        self.vocabs: List[str] = meta['vocabs']
+        self.predicates: List[str] = meta['predicates']
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._ids = self._array('ids')
+        self._vocab_rows = self._array('vocab')
+        self._code_order = self._array('code_order')
+
+    def _array(self, name: str) -> 'np.ndarray':
+        """Memory-map array, once"""
+        import numpy as np
+        if name not in self._arrays:
+            self._arrays[name] = np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def _string(self, name: str, row: int) -> str:
+        """Get string of row"""
+        offsets = self._array(f'{name}.offsets')
+        return self._array(f'{name}.bytes')[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def _row(self, concept_id: Union[int, str]) -> int:
+        """Get row of concept, or -1 if not in index"""
+        concept_id = int(concept_id)
+        row = int(self._ids.searchsorted(concept_id))
+        return row if row < len(self._ids) and self._ids[row] == concept_id else -1
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, concept_id: Union[int, str]) -> bool:
+        return self._row(concept_id) != -1
+
+    def label(self, concept_id: Union[int, str]) -> Union[str, None]:
+        """Get concept_name of concept"""
+        row = self._row(concept_id)
+        return self._string('label', row) if row != -1 else None
+
+    def concept(self, concept_id: Union[int, str]) -> Union[Dict[str, Union[int, str]], None]:
+        """Get concept_id, concept_name, vocabulary_id, and concept_code of concept"""
+        row = self._row(concept_id)
+        if row == -1:
+            return None
+        return {
+            'concept_id': int(self._ids[row]),
+            'concept_name': self._string('label', row),
+            'vocabulary_id': self.vocabs[self._vocab_rows[row]],
+            'concept_code': self._string('code', row),
+        }
+
+    def lookup_code(self, vocabulary_id: str, concept_code: str) -> Union[int, None]:
+        """Get concept_id of a vocabulary's code"""
+        if vocabulary_id not in self.vocabs:
+            return None
+        key = (self.vocabs.index(vocabulary_id), concept_code)
+        lo, hi = 0, len(self._code_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = self._code_order[mid]
+            mid_key = (self._vocab_rows[row], self._string('code', row))
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return int(self._ids[row])
+        return None
+
+    def related(self, concept_id: Union[int, str], predicate: str, reverse=False) -> List[int]:
+        """Get objects of concept's relationships of a predicate, or subjects if reverse"""
+        row = self._row(concept_id)
+        if row == -1 or predicate not in self.predicates:
+            return []
+        name = f'rel{self.predicates.index(predicate)}.{"rev" if reverse else "fwd"}'
+        indptr = self._array(f'{name}.indptr')
+        return self._array(f'{name}.indices')[indptr[row]:indptr[row + 1]].tolist()
+
+    def parents(self, concept_id: Union[int, str]) -> List[int]:
+        """Get parents of concept"""
+        return self.related(concept_id, PARENT_PREDICATE)
+
+    def children(self, concept_id: Union[int, str]) -> List[int]:
+        """Get children of concept"""
+        return self.related(concept_id, PARENT_PREDICATE, reverse=True)
+
+    def mappings(self, concept_id: Union[int, str]) -> List[int]:
+        """Get concepts that concept maps to"""
+        return self.related(concept_id, MAPPING_PREDICATE)
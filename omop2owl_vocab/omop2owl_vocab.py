@@ -17,19 +17,33 @@ import pickle
 import shutil
 import subprocess
 import sys
+import threading
 from argparse import ArgumentParser
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Set, Tuple, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Set, Tuple, Union
 
-import pandas as pd
+from omop2owl_vocab.checkpoint import Checkpoints, atomic_output
+from omop2owl_vocab.index import write_index
+from omop2owl_vocab.sanitize import sanitize
+from omop2owl_vocab.scheduler import Job, estimate_heap_gb, get_memory_budget_gb, run_jobs
+from omop2owl_vocab.subset import get_subset_id, subset_concepts
+
+# Heavy dependencies are imported inside the functions that need them, so that `--help`, `--install`, and
+# `--semsql-only` start up quickly.
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 PREFIX = str
 CURIE = str
 URI_STEM = str
 CONCEPT_ID = int
 PREDICATE_ID = str
+RELATIONSHIP_ID = str
 REL_MAPS = Dict[PREDICATE_ID, Dict[CONCEPT_ID, List[CONCEPT_ID]]]
+REL_MAPS_BY_REL = Dict[RELATIONSHIP_ID, Dict[CONCEPT_ID, List[CONCEPT_ID]]]
 SRC_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
 PROJECT_DIR = SRC_DIR.parent
 ROBOT_PATH = SRC_DIR / 'robot.jar'
@@ -47,18 +61,22 @@ CONCEPT_DTYPES = {
     'concept_class_id': str,
     'standard_concept': str,
     'concept_code': str,
-    'valid_start_date': str,  # is date, but we're just serializing, not manipulating
-    'valid_end_date': str,  # is date, but we're just serializing, not manipulating
+    'valid_start_date': str,  # is date; parsed into YYYYMMDD int after reading
+    'valid_end_date': str,  # is date; parsed into YYYYMMDD int after reading
     'invalid_reason': str
 }
 CONCEPT_RELATIONSHIP_DTYPES = {
     'concept_id_1': str,  # is int, but we're just serializing, not manipulating
     'concept_id_2': str,  # is int, but we're just serializing, not manipulating
     'relationship_id': str,
-    'valid_start_date': str,  # is date, but we're just serializing, not manipulating
-    'valid_end_date': str,  # is date, but we're just serializing, not manipulating
+    'valid_start_date': str,  # is date; parsed into YYYYMMDD int after reading
+    'valid_end_date': str,  # is date; parsed into YYYYMMDD int after reading
     'invalid_reason': str,
 }
+DATE_FIELDS = ['valid_start_date', 'valid_end_date']
+# DATE_FORMATS: Accepted date formats, by length
+DATE_FORMATS = {10: '%Y-%m-%d', 8: '%Y%m%d'}
+CSV_CHUNKSIZE = 1_000_000
 ROBOT_SUBHEADER = {
     'ID': 'ID',
     'Label': 'A rdfs:label',
@@ -92,10 +110,26 @@ ROBOT_PREFIX_ERR_REPLACEMENTS = {
     'relations': 'omoprel',
     'terms': 'OMOP',
 }
+# OMOP2OWL_SETTINGS: CLI arguments / batch job settings that are passed directly to omop2owl()
+OMOP2OWL_SETTINGS = [
+    'concept_csv_path', 'concept_relationship_csv_path', 'outdir', 'ontology_id', 'vocabs', 'relationships',
+    'skip_semsql', 'exclude_singletons', 'use_cache', 'memory', 'as_of', 'index', 'seed_concepts', 'seed_predicates',
+    'seed_up_depth', 'seed_down_depth', 'resume', 'workers']
+# OUTPUT_TYPE_SETTINGS: omop2owl() arguments for each --output-type. These take precedence over OMOP2OWL_SETTINGS.
+OUTPUT_TYPE_SETTINGS = {
+    'split': {'split_by_vocab': True},
+    'merged-post-split': {'split_by_vocab': True, 'split_by_vocab_merge_after': True},  # Default
+    'merged': {'split_by_vocab': False},
+    'rxnorm': {
+        'split_by_vocab': True, 'vocabs': ['RxNorm', 'ATC'], 'relationships': ['Is a', 'Maps to', 'RxNorm inverse is a']},
+}
 CONFIG = {
     'semsql_show_stacktrace': ['full', 'lite', 'none'][0]
 }
 PROG = 'omop2owl-vocab'
+# SEMSQL_LOCK: SemanticSQL conversions share intermediate files in the output directory, e.g. prefixes.csv, so when
+# vocabs are run concurrently, they convert one at a time.
+SEMSQL_LOCK = threading.Lock()
 DESC = 'Convert OMOP vocabularies to OWL and SemanticSQL.'
 
 
@@ -114,6 +148,12 @@ def _run_command(command: str):
 
 def _convert_semsql(owl_outpath: str, quiet=False, memory: int = 100):
     """Convert to SemanticSQL"""
+    with SEMSQL_LOCK:
+        _convert_semsql_unlocked(owl_outpath, quiet, memory)
+
+
+def _convert_semsql_unlocked(owl_outpath: str, quiet=False, memory: int = 100):
+    """Convert to SemanticSQL. Use _convert_semsql() instead, unless already holding SEMSQL_LOCK."""
     if not quiet:
         print(f' - converting to SemanticSQL')
     # todo: ideal if backtrace worked: ex: RUST_BACKTRACE=full semsql make $@ -P config/prefixes.csv
@@ -164,28 +204,59 @@ def _cleanup_leftover_semsql_intermediates(_dir):
             os.remove(f)
 
 
-def _get_merged_file_outpath(outdir: str, ontology_id: str, vocabs: List[str]) -> str:
+def _get_merged_file_outpath(
+    outdir: str, ontology_id: str, vocabs: List[str], as_of: int = 0, subset_id: str = ''
+) -> str:
     """Get outpath of merged ontology
+
+    Named after the subset, if any, and the snapshot date, if any, so that subsets and snapshots can share an output
+    directory, and so the parse cache, with the full ontology.
     todo: excessive customization for rxnorm here is code smell. what if rxnorm + atc situation changes?"""
     out_filename = f'{ontology_id}.owl'
     outpath_owl = os.path.join(outdir, out_filename)
     outpath = outpath_owl if not vocabs \
         else outpath_owl.replace(out_filename, f'{ontology_id}-RxNorm.owl') if 'RxNorm' in vocabs and len(vocabs) < 3 \
         else outpath_owl.replace(out_filename, f'{ontology_id}-{"-".join(vocabs)}.owl')
+    if subset_id:
+        outpath = outpath.replace('.owl', f'-subset-{subset_id}.owl')
+    if as_of:
+        outpath = outpath.replace('.owl', f'-as-of-{as_of}.owl')
     return outpath
 
 
-def _create_outputs(
-    df: pd.DataFrame, rel_maps: REL_MAPS, outpath: Union[Path, str], ontology_iri: str,
-    robot_subheader: Dict[str, str] = ROBOT_SUBHEADER, use_cache=False, skip_semsql=False, memory: int = 100,
-    do_fixes=True, retain_robot_templates=True
-) -> bool:
-    """Create robot template and convert to OWL and SemanticSQL
-    :returns Whether or not using cached version of OWL"""
-    # todo: remove this replacement when taken care of properly elsewhere
-    outpath = os.path.join(os.path.dirname(outpath), os.path.basename(outpath).replace(' ', '-'))
-    # concepts_in_domain = set(df.index)
-    outpath_template = str(outpath).replace('.owl', '.robot.template.tsv')
+def _join_object_curies(concept_ids: 'pd.Index', rel_map: Dict[CONCEPT_ID, List[CONCEPT_ID]]) -> 'np.ndarray':
+    """Get the objects of each concept in a relationship map, as '|'-separated CURIEs, or '' if it has none
+
+    Concept IDs are integers, so need no sanitizing, and their CURIEs are built by plain concatenation."""
+    import numpy as np
+    empty: List[CONCEPT_ID] = []
+    objects = (rel_map.get(x, empty) for x in concept_ids)
+    return np.array(['OMOP:' + '|OMOP:'.join(x) if x else '' for x in objects], dtype=object)
+
+
+def _get_vocab_outpath(
+    outdir: str, vocab: str, ontology_id: str = 'OMOP', as_of: int = 0, subset_id: str = ''
+) -> Path:
+    """Get outpath of a single vocab's output, when splitting by vocab
+
+    Named after the ontology ID, unless it is the default, the subset, if any, and the snapshot date, if any, so that
+    runs that share an output directory, e.g. several --as-of snapshots sharing the parse cache, or a --seed-concepts
+    subset of the full ontology, don't overwrite each other's vocab outputs, nor reuse them if use_cache."""
+    parts = [vocab] if ontology_id == 'OMOP' else [ontology_id, vocab]
+    if subset_id:
+        parts.append(f'subset-{subset_id}')
+    if as_of:
+        parts.append(f'as-of-{as_of}')
+    return Path(outdir) / f'{"-".join(parts)}.owl'.replace(' ', '-')
+
+
+def _create_robot_template(
+    df: 'pd.DataFrame', rel_maps: REL_MAPS, outpath_template: Union[Path, str],
+    robot_subheader: Dict[str, str] = ROBOT_SUBHEADER
+):
+    """Create robot template of concepts and their relationships"""
+    import numpy as np
+    import pandas as pd
     # rdfs:subClassOf represented always as 'SC' in robot subheader, so handled separately
 
     # todo#4: ConceptMap getting mappings OK w/ this change?
@@ -198,80 +269,94 @@ def _create_outputs(
     # robot_subheader = \
     #     robot_subheader | {rel_predicate: f'A {rel_predicate} SPLIT=|' for rel_predicate in [x for x in rel_maps.keys() if x != 'rdfs:subClassOf']}
 
-    if not(os.path.exists(outpath_template) and use_cache):
+    # - Rows in ascending order of concept ID, so that outputs are the same regardless of the order of the inputs
+    df = df[~df.index.duplicated(keep='last')]
+    df = df.iloc[np.argsort(df.index.to_numpy(dtype=np.int64), kind='stable')]
+    # - CURIEs of concepts are built by plain concatenation, as concept IDs are integers, so need no sanitizing
+    robot_df = pd.DataFrame({
+        'ID': 'OMOP:' + df.index.to_numpy(dtype=object),
+        'Label': df.concept_name.to_numpy(),
+        'Type': 'class',
+        **{field: df[field].to_numpy() for field in [
+            'domain_id', 'vocabulary_id', 'concept_class_id', 'standard_concept', 'concept_code']},
+        **{field: _format_dates(df[field]).to_numpy() for field in DATE_FIELDS},
+        'invalid_reason': df.invalid_reason.to_numpy(),
+        'rdfs:subClassOf': '',
+    })
+    for rel, rel_map_i in rel_maps.items():
+        robot_df[rel] = _join_object_curies(df.index, rel_map_i)
+
+    # - Create CSV
+    robot_df = pd.concat([pd.DataFrame([robot_subheader]), robot_df])[list(robot_subheader.keys())]
+    with atomic_output(outpath_template) as tmp_path:
+        robot_df.to_csv(tmp_path, index=False, sep='\t')
+
+
+def _create_outputs(
+    df: 'pd.DataFrame', rel_maps: REL_MAPS, outpath: Union[Path, str], ontology_iri: str,
+    robot_subheader: Dict[str, str] = ROBOT_SUBHEADER, use_cache=False, skip_semsql=False, memory: int = 100,
+    do_fixes=True, retain_robot_templates=True, checkpoints: Checkpoints = None
+) -> bool:
+    """Create robot template and convert to OWL and SemanticSQL
+    :param checkpoints: If passed, skips stages that it has recorded as done, and records stages as they complete.
+    :returns Whether or not using cached version of OWL"""
+    # todo: remove this replacement when taken care of properly elsewhere
+    outpath = os.path.join(os.path.dirname(outpath), os.path.basename(outpath).replace(' ', '-'))
+    # concepts_in_domain = set(df.index)
+    outpath_template = str(outpath).replace('.owl', '.robot.template.tsv')
+
+    stage = os.path.basename(outpath)
+    using_cached_owl: bool = (os.path.exists(outpath) and use_cache) or \
+        bool(checkpoints and checkpoints.done(f'{stage}:owl'))
+    if not using_cached_owl and not(os.path.exists(outpath_template) and use_cache):
         print(f' - creating robot template')
-        d: Dict[CURIE, Dict[str, str]] = {}
-        for row in df.itertuples():
-            # todo: faster if I build curies beforehand
-            # noinspection PyUnresolvedReferences It_doesnt_know_that_row_is_a_namedtuple
-            curie_omop = f'OMOP:{row.Index}'
-            # noinspection PyUnresolvedReferences It_doesnt_know_that_row_is_a_namedtuple
-            row_dict = {
-                'ID': curie_omop,
-                'Label': row.concept_name,
-                'Type': 'class',
-                'domain_id': row.domain_id,
-                'vocabulary_id': row.vocabulary_id,
-                'concept_class_id': row.concept_class_id,
-                'standard_concept': row.standard_concept,
-                'concept_code': row.concept_code,
-                'valid_start_date': row.valid_start_date,
-                'valid_end_date': row.valid_end_date,
-                'invalid_reason': row.invalid_reason,
-                'rdfs:subClassOf': '',
-            }
-            # todo: faster if jagged? e.g. each entry has actual amount its parents & let pd.DataFrame(d.values()) handle?
-            for rel, rel_map_i in rel_maps.items():
-                try:
-                    # noinspection PyUnresolvedReferences It_doesnt_know_that_row_is_a_namedtuple
-                    concept_ids: List[int] = rel_map_i[row.Index]
-                    # if parent_concept_id not in concepts_in_domain:
-                    #     print(f'Warning: Parent not in vocab. This causes issue w/ our strategy to split table.: {vocab_id}', file=sys.stderr)
-                    row_dict[rel] = '|'.join([f'OMOP:{x}' for x in concept_ids])
-                except (KeyError, IndexError):
-                    row_dict[rel] = ''
-            d[curie_omop] = row_dict
-
-        # - Create CSV
-        robot_df = pd.DataFrame([robot_subheader] + list(d.values()))
-        robot_df.to_csv(outpath_template, index=False, sep='\t')
-
-    using_cached_owl: bool = os.path.exists(outpath) and use_cache
+        _create_robot_template(df, rel_maps, outpath_template, robot_subheader)
+
     if not using_cached_owl:
         # Convert to OWL
         print(f' - converting to OWL')
-        command = \
-            f'export ROBOT_JAVA_ARGS=-Xmx{str(memory)}G; ' \
-            f'java -jar {ROBOT_PATH} template ' \
-            f'--template "{outpath_template}" ' \
-            f'--ontology-iri "{ontology_iri}" ' \
-            f'--output "{outpath}"'
-        for k, v in PREFIX_MAP.items():
-            command += f' --prefix "{k}: {v}"'
-        out, err = _run_command(command)
-        if (err and 'error' in err.lower()) or (out and 'error' in out.lower()):
-            raise RuntimeError(err)
-
-    if not retain_robot_templates:
+        with atomic_output(outpath) as tmp_path:
+            command = \
+                f'java -Xmx{str(memory)}G -jar {ROBOT_PATH} template ' \
+                f'--template "{outpath_template}" ' \
+                f'--ontology-iri "{ontology_iri}" ' \
+                f'--output "{tmp_path}"'
+            for k, v in PREFIX_MAP.items():
+                command += f' --prefix "{k}: {v}"'
+            out, err = _run_command(command)
+            if (err and 'error' in err.lower()) or (out and 'error' in out.lower()):
+                raise RuntimeError(err)
+            if do_fixes:
+                _fix_robot_prefixes(tmp_path)
+        if checkpoints:
+            checkpoints.complete(f'{stage}:owl', outpath)
+            checkpoints.invalidate(f'{stage}:semsql')
+
+    if not retain_robot_templates and os.path.exists(outpath_template):
         os.remove(outpath_template)
 
-    if do_fixes:
-        # Fix issue w/ robot not accepting --prefix'es
-        with open(outpath, 'r') as f:
-            contents = f.read()
-        for k, v in ROBOT_PREFIX_ERR_REPLACEMENTS.items():
-            contents = contents.replace(f'<{k}:', f'<{v}:')  # opening tags
-            contents = contents.replace(f'</{k}:', f'</{v}:')  # closing tags
-            contents = contents.replace(f'xmlns:{k}', f'xmlns:{v}')  # header
-        with open(outpath, 'w') as f:
-            f.write(contents)
-
-    if not(os.path.exists(str(outpath).replace('.owl', '.db')) and use_cache) and not skip_semsql:
-        _convert_semsql(outpath)
+    db_path = str(outpath).replace('.owl', '.db')
+    semsql_done = (os.path.exists(db_path) and use_cache) or bool(checkpoints and checkpoints.done(f'{stage}:semsql'))
+    if not semsql_done and not skip_semsql:
+        _convert_semsql(outpath, memory=memory)
+        if checkpoints:
+            checkpoints.complete(f'{stage}:semsql', db_path)
 
     return using_cached_owl
 
 
+def _fix_robot_prefixes(owl_path: str):
+    """Fix issue w/ robot not accepting --prefix'es"""
+    with open(owl_path, 'r') as f:
+        contents = f.read()
+    for k, v in ROBOT_PREFIX_ERR_REPLACEMENTS.items():
+        contents = contents.replace(f'<{k}:', f'<{v}:')  # opening tags
+        contents = contents.replace(f'</{k}:', f'</{v}:')  # closing tags
+        contents = contents.replace(f'xmlns:{k}', f'xmlns:{v}')  # header
+    with open(owl_path, 'w') as f:
+        f.write(contents)
+
+
 def _get_header_body_footer(file_str: str) -> Tuple[str, str, str]:
     """From an RDF/XML OWL serialization string, extract header and body as 2 string objects
     Code created largely through: https://chat.openai.com/share/2c4c8eb7-c7a5-496e-add3-c6f5687e04eb"""
@@ -294,78 +379,266 @@ def _get_header_body_footer(file_str: str) -> Tuple[str, str, str]:
     return header, body, footer
 
 
-def _get_relationship_maps(concept_rel_df: pd.DataFrame, relationships: List[str], concept_ids: Set[str]) -> REL_MAPS:
-    """Get relationship maps"""
-    concept_rel_df = concept_rel_df.sort_values(['relationship_id'])
-    rel_maps: REL_MAPS = {}
-    rels = relationships if relationships != ['ALL'] else concept_rel_df.relationship_id.unique()
-    # XML namespace encoding. See: https://github.com/HOT-Ecosystem/omop2owl/issues/10
-    # - allowed: : _ - .
-    sanitized_rel_map = {
-        x: x.replace(" ", "_")
-        .replace("\t", "_")
-        .replace("\n", "_")
-        .replace(",", "_")
-        .replace("|", "_")
-        .replace(";", "_")
-        .replace("/", ".")
-        .replace("\\", ".")
-        .replace("~", "-")
-        .replace("`", "-")
-        .replace("!", "-")
-        .replace("@", "-")
-        .replace("#", "-")
-        .replace("$", "-")
-        .replace("%", "-")
-        .replace("^", "-")
-        .replace("*", "-")
-        .replace("+", "-")
-        .replace("=", "-")
-        .replace("?", "-")
-        .replace("'", "-")
-        .replace('"', "-")
-        .replace("(", "-")
-        .replace(")", "-")
-        .replace("[", "-")
-        .replace("]", "-")
-        .replace("{", "-")
-        .replace("}", "-")
-        .replace("<", "-")
-        .replace(">", "-")
-        for x in rels
-    }
-    # todo: any way to increase performance?
-    for i, rel_mapping in enumerate(sanitized_rel_map.items()):
-        rel, sanitized_rel = rel_mapping
+def _get_predicate(rel: RELATIONSHIP_ID) -> PREDICATE_ID:
+    """Get predicate for an OMOP relationship_id"""
+    return REL_PRED_MAPPINGS[rel] if rel in REL_PRED_MAPPINGS else f'omoprel:{sanitize(rel)}'
+
+
+def _get_relationship_maps_by_rel(
+    concept_rel_df: 'pd.DataFrame', relationships: List[str], concept_ids: Set[str]
+) -> REL_MAPS_BY_REL:
+    """Get relationship maps, keyed by OMOP relationship_id rather than by predicate
+
+    Subjects are always among concept_ids, as are the objects of reversed relationships. Maps are canonical, so that
+    outputs are the same regardless of the order of the input rows: subjects and each subject's objects are in
+    ascending order of concept ID, and repeated rows are only included once."""
+    maps_by_rel: REL_MAPS_BY_REL = {}
+    rels = relationships if relationships != ['ALL'] else sorted(concept_rel_df.relationship_id.unique())
+    for i, rel in enumerate(rels):
         print(f' - {i + 1} of {len(rels)}: {rel}')
-        reverse_rel, remapped_rel = rel in REL_PRED_REVERSE_MAPPING, rel in REL_PRED_MAPPING
-        pred: PREDICATE_ID = REL_PRED_REVERSE_MAPPING[rel] if reverse_rel else REL_PRED_MAPPINGS[rel] if remapped_rel\
-            else f'omoprel:{sanitized_rel}'
-        rel_maps[pred] = {}
-        # pred: PREDICATE_ID = f'omoprel:{rel}' if rel not in REL_PRED_MAP else REL_PRED_MAP[rel]
         df_i = concept_rel_df[concept_rel_df.relationship_id == rel]
         df_i = df_i[df_i['concept_id_1'].isin(concept_ids)]
-
-        # todo: any way to increase performance below?
-        # rel_maps[pred]: chatgpt thought this was faster but in 1 experiemnt it was 3x slower
-        # rel_maps[pred] = df_i.groupby('concept_id_2')['concept_id_1'].apply(list).to_dict()
-        for row in df_i.itertuples(index=False):
-            if reverse_rel:
-                rel_maps[pred].setdefault(row.concept_id_2, []).append(row.concept_id_1)
-            else:
-                rel_maps[pred].setdefault(row.concept_id_1, []).append(row.concept_id_2)
+        src, dst = ('concept_id_2', 'concept_id_1') if rel in REL_PRED_REVERSE_MAPPING \
+            else ('concept_id_1', 'concept_id_2')
+        if src != 'concept_id_1':
+            df_i = df_i[df_i[src].isin(concept_ids)]
+        maps_by_rel[rel] = _get_canonical_map(df_i[src], df_i[dst])
+    return maps_by_rel
+
+
+def _get_canonical_map(src: 'pd.Series', dst: 'pd.Series') -> Dict[CONCEPT_ID, List[CONCEPT_ID]]:
+    """Get map of subject to objects from edges, sorted by concept ID and deduplicated"""
+    import numpy as np
+    src, dst = src.to_numpy(dtype=np.int64), dst.to_numpy(dtype=np.int64)
+    order = np.lexsort((dst, src))
+    src, dst = src[order], dst[order]
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst = src[keep], dst[keep]
+    subjects, starts = np.unique(src, return_index=True)
+    objects: List[CONCEPT_ID] = dst.astype(str).tolist()
+    ends = np.append(starts[1:], len(objects)).tolist()
+    return {k: objects[i:j] for k, i, j in zip(subjects.astype(str).tolist(), starts.tolist(), ends)}
+
+
+def _combine_relationship_maps(
+    maps_by_rel: REL_MAPS_BY_REL, relationships: List[str] = ['ALL'], concept_ids: Set[str] = None
+) -> REL_MAPS:
+    """Combine relationship maps of selected relationships into maps by predicate
+
+    Several relationships can map to the same predicate, e.g. 'Is a' and 'RxNorm inverse is a', in which case their
+    maps are merged. Does not modify maps_by_rel, so it can be shared by several outputs.
+    :param relationships: Relationships to include. ['ALL'] includes those in maps_by_rel that have any edges, so that
+    outputs do not get empty predicates, e.g. of relationships that only other vocabs have.
+    :param concept_ids: If maps_by_rel was created from more concepts than the output needs, e.g. for several outputs
+    at once, the concepts of this output. Maps are then restricted to the ones _get_relationship_maps_by_rel() would
+    have created from only these concepts: subjects must be among them, as must the objects of reversed
+    relationships. Otherwise, e.g. the index and --seed-concepts closure would walk edges of other vocabs."""
+    rel_maps: REL_MAPS = {}
+    rels = maps_by_rel.keys() if relationships == ['ALL'] else relationships
+    for rel in rels:
+        pred: PREDICATE_ID = _get_predicate(rel)
+        rel_map = maps_by_rel.get(rel, {})
+        if concept_ids is not None:
+            rel_map = {k: v for k, v in rel_map.items() if k in concept_ids}
+        if concept_ids is not None and rel in REL_PRED_REVERSE_MAPPING:
+            rel_map = {k: [x for x in v if x in concept_ids] for k, v in rel_map.items()}
+            rel_map = {k: v for k, v in rel_map.items() if v}
+        if not rel_map and relationships == ['ALL']:
+            continue
+        if pred not in rel_maps:
+            rel_maps[pred] = rel_map
+            continue
+        merged_map = {k: list(v) for k, v in rel_maps[pred].items()}
+        for k, v in rel_map.items():
+            merged_map[k] = sorted(set(merged_map.get(k, []) + v), key=int)
+        rel_maps[pred] = dict(sorted(merged_map.items(), key=lambda x: int(x[0])))
     return rel_maps
 
 
+def _get_relationship_maps(concept_rel_df: 'pd.DataFrame', relationships: List[str], concept_ids: Set[str]) -> REL_MAPS:
+    """Get relationship maps"""
+    return _combine_relationship_maps(
+        _get_relationship_maps_by_rel(concept_rel_df, relationships, concept_ids), relationships)
+
+
+def _get_relationship_degrees(
+    concept_rel_df: 'pd.DataFrame', relationships: List[str], concept_ids: Set[str]
+) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Count degree, i.e. number of edges as either subject or object, of each concept in the selected relationships.
+
+    Only counts rows that _get_relationship_maps() would also use: both concepts of reversed relationships, and the
+    subject of others, must be among concept_ids. Can be called for each chunk of the concept_relationship table and
+    combined via _merge_relationship_degrees().
+    :returns Sorted unique concept IDs (int) and their degrees."""
+    import numpy as np
+    if relationships != ['ALL']:
+        concept_rel_df = concept_rel_df[concept_rel_df.relationship_id.isin(relationships)]
+    is_reversed = concept_rel_df.relationship_id.isin(list(REL_PRED_REVERSE_MAPPING.keys()))
+    concept_rel_df = concept_rel_df[
+        concept_rel_df.concept_id_1.isin(concept_ids) & (~is_reversed | concept_rel_df.concept_id_2.isin(concept_ids))]
+    ids = np.concatenate([
+        concept_rel_df.concept_id_1.to_numpy(dtype=np.int64), concept_rel_df.concept_id_2.to_numpy(dtype=np.int64)])
+    return np.unique(ids, return_counts=True)
+
+
+def _merge_relationship_degrees(*degrees: Tuple['np.ndarray', 'np.ndarray']) -> Tuple['np.ndarray', 'np.ndarray']:
+    """Combine outputs of _get_relationship_degrees(), e.g. from several chunks."""
+    import numpy as np
+    if not degrees:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    ids, inverse = np.unique(np.concatenate([x[0] for x in degrees]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([x[1] for x in degrees]), minlength=len(ids))
+    return ids, counts.astype(np.int64)
+
+
+def _exclude_singletons(concept_df: 'pd.DataFrame', degrees: Tuple['np.ndarray', 'np.ndarray']) -> 'pd.DataFrame':
+    """Filter out concepts that have no edges, given output of _get_relationship_degrees()"""
+    import numpy as np
+    ids, counts = degrees
+    concept_ids = concept_df.index.to_numpy(dtype=np.int64)
+    return concept_df[np.isin(concept_ids, ids[counts > 0])]
+
+
+def _get_file_signature(path: str) -> str:
+    """Get signature of file that changes whenever it is modified"""
+    if not path or not os.path.exists(path):
+        return str(path)
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}__{stat.st_size}__{stat.st_mtime_ns}'
+
+
+def _parse_date(date: Union[str, int, None]) -> int:
+    """Parse a date, e.g. '2020-03-13' (N3C) or '20200313' (Athena), into a compact YYYYMMDD int. Missing is 0.
+    :raises ValueError: If not a valid date in one of those formats"""
+    if date is None or date == '':
+        return 0
+    date = str(date)
+    date_format = DATE_FORMATS.get(len(date))
+    try:
+        if not date_format:
+            raise ValueError
+        parsed = datetime.strptime(date, date_format)
+        # - strptime() also accepts e.g. single digit months, so the date must also be in exactly this format
+        if parsed.strftime(date_format) != date:
+            raise ValueError
+        return int(parsed.strftime('%Y%m%d'))
+    except ValueError:
+        raise ValueError(f'Invalid date: {date!r}. Expected YYYY-MM-DD or YYYYMMDD.') from None
+
+
+def _parse_dates(series: 'pd.Series') -> 'pd.Series':
+    """Vectorized _parse_date(). Dates repeat a lot, so only the unique values are parsed.
+    :raises ValueError: If any value is not a valid date"""
+    import numpy as np
+    import pandas as pd
+    codes, uniques = pd.factorize(series)
+    try:
+        parsed = np.array([_parse_date(x) for x in uniques] + [0], dtype=np.int32)  # Last: for nulls (code -1)
+    except ValueError as err:
+        raise ValueError(f'{series.name}: {err}') from None
+    return pd.Series(parsed.take(codes), index=series.index, name=series.name)
+
+
+def _format_dates(series: 'pd.Series') -> 'pd.Series':
+    """Format YYYYMMDD ints as YYYY-MM-DD strings. Missing (0) becomes ''."""
+    s = series.astype(str)
+    return (s.str[:4] + '-' + s.str[4:6] + '-' + s.str[6:]).where(series != 0, '')
+
+
+def _valid_as_of(df: 'pd.DataFrame', as_of: int) -> 'pd.Series':
+    """Which rows were valid on the given YYYYMMDD date. A missing valid_end_date is treated as open-ended."""
+    return (df.valid_start_date <= as_of) & ((df.valid_end_date >= as_of) | (df.valid_end_date == 0))
+
+
+def _detect_sep(path: str) -> str:
+    """Detect separator. N3C OMOP tables are CSV, but Athena ones are TSV."""
+    with open(path) as f:
+        header = f.readline()
+    return '\t' if '\t' in header else ','
+
+
+def _read_table(
+    path: str, dtypes: Dict[str, Any], chunk_filter: Callable[['pd.DataFrame'], 'pd.DataFrame'], cache_dir: str,
+    use_cache=False, index_col: str = None, on_chunk: Callable[['pd.DataFrame'], Any] = None
+) -> 'pd.DataFrame':
+    """Read an OMOP table, parsing its date fields into compact YYYYMMDD ints
+
+    Rows are read in chunks and filtered via chunk_filter as they are read, so rows that are filtered out are never all
+    held in memory at once. If use_cache, the whole parsed table is instead cached (or loaded from cache) and then
+    filtered, so that runs with different filters, e.g. several --as-of snapshots, only parse the table once.
+    :param on_chunk: Optional function called with each filtered chunk, e.g. to compute statistics while reading. If
+    use_cache, called once, with the whole filtered table."""
+    import pandas as pd
+    cache_hash = hashlib.md5(_get_file_signature(path).encode('utf-8')).hexdigest()
+    cache_path = os.path.join(cache_dir, 'omop2owl-vocab_parse-cache-' + cache_hash + '.pkl')
+    if use_cache and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            df = chunk_filter(pickle.load(f))
+        if on_chunk:
+            on_chunk(df)
+        return df
+
+    chunks: List[pd.DataFrame] = []
+    reader = pd.read_csv(
+        path, index_col=index_col, dtype=dtypes, sep=_detect_sep(path), chunksize=None if use_cache else CSV_CHUNKSIZE)
+    for chunk in [reader] if use_cache else reader:
+        chunk = chunk.fillna('')
+        for field in DATE_FIELDS:
+            chunk[field] = _parse_dates(chunk[field])
+        if not use_cache:
+            chunk = chunk_filter(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+        chunks.append(chunk)
+    df = pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+    if use_cache:
+        with atomic_output(cache_path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        df = chunk_filter(df)
+        if on_chunk:
+            on_chunk(df)
+    return df
+
+
+def _filter_concepts(concept_df: 'pd.DataFrame', vocabs: List[str] = [], as_of: int = None) -> 'pd.DataFrame':
+    """Filter concept table by vocabulary and validity date"""
+    if vocabs:
+        concept_df = concept_df[concept_df.vocabulary_id.isin(vocabs)]
+    if as_of:
+        concept_df = concept_df[_valid_as_of(concept_df, as_of)]
+    return concept_df
+
+
+def _filter_concept_relationships(
+    concept_rel_df: 'pd.DataFrame', concept_ids: Set[str], vocabs: List[str] = [], as_of: int = None
+) -> 'pd.DataFrame':
+    """Filter concept_relationship table by validity and by the concepts that were kept
+
+    If as_of, keeps relationships valid on that date, regardless of their current invalid_reason. Otherwise, keeps
+    currently valid relationships."""
+    if as_of:
+        concept_rel_df = concept_rel_df[_valid_as_of(concept_rel_df, as_of)]
+    else:
+        concept_rel_df = concept_rel_df[concept_rel_df.invalid_reason == '']
+    if vocabs or as_of:
+        concept_rel_df = concept_rel_df[
+            (concept_rel_df.concept_id_1.isin(concept_ids)) |
+            (concept_rel_df.concept_id_2.isin(concept_ids))]
+    return concept_rel_df
+
+
 def _get_core_objects(
     concept_csv_path: str, concept_relationship_csv_path: str, outpath: str, vocabs: List[str] = [], relationships: List[str] = ['Is a'],
-    exclude_singletons: bool = False, use_cache=False
-) -> Tuple[pd.DataFrame, REL_MAPS, str]:
+    exclude_singletons: bool = False, use_cache=False, as_of: int = None
+) -> Tuple['pd.DataFrame', REL_MAPS, str]:
     """Get core objects"""
     t_0 = datetime.now()
     # Load cache
     cache_name = os.path.basename(outpath).replace(".owl", "") + (
-        f'__vocabs_{"_".join(vocabs)}' if vocabs else '') + f'__relationships_{"_".join(relationships)}'
+        f'__vocabs_{"_".join(vocabs)}' if vocabs else '') + f'__relationships_{"_".join(relationships)}' + (
+        '__exclude_singletons' if exclude_singletons else '') + (f'__as_of_{as_of}' if as_of else '')
     cache_hash = hashlib.md5(cache_name.encode('utf-8')).hexdigest()
     cache_path = os.path.join(os.path.dirname(outpath), 'omop2owl-vocab_general-cache-' + cache_hash + '.pkl')
     if use_cache and os.path.exists(cache_path):
@@ -376,31 +649,25 @@ def _get_core_objects(
             return d['concept_df'], d['rel_maps'], cache_path
 
     # Read inputs
-    # todo: sep: optimize? N3C OMOP tables are CSV, but Athena ones are TSV. One possible solution is (a) I try/except
-    #  but I went with (b) sep=None, which automatically determines. Only downside to this is it goes from the C engine
-    #  to the Python engine, which I'm assuming is slower.
-    sep = None
+    cache_dir = os.path.dirname(outpath)
     # - concept table
-    concept_df = pd.read_csv(concept_csv_path, index_col='concept_id', dtype=CONCEPT_DTYPES, sep=sep).fillna('')
+    concept_df = _read_table(
+        concept_csv_path, CONCEPT_DTYPES, lambda df: _filter_concepts(df, vocabs, as_of), cache_dir, use_cache,
+        index_col='concept_id')
     concept_ids: Set[str] = set(concept_df.index)
     t_1 = datetime.now()
     print('Read "concept" table in', (t_1 - t_0).seconds, 'seconds')
 
     # - concept_relationship table
-    concept_rel_df = pd.read_csv(concept_relationship_csv_path, dtype=CONCEPT_RELATIONSHIP_DTYPES, sep=sep).fillna('')
-    concept_rel_df = concept_rel_df[concept_rel_df.invalid_reason == '']
+    # -- If excluding singletons, degrees are counted chunk by chunk as the table is read
+    degrees: List[Tuple['np.ndarray', 'np.ndarray']] = []
+    concept_rel_df = _read_table(
+        concept_relationship_csv_path, CONCEPT_RELATIONSHIP_DTYPES,
+        lambda df: _filter_concept_relationships(df, concept_ids, vocabs, as_of), cache_dir, use_cache,
+        on_chunk=(lambda df: degrees.append(_get_relationship_degrees(df, relationships, concept_ids)))
+        if exclude_singletons else None)
     t_2 = datetime.now()
     print('Read "concept_relationships" table in', (t_2 - t_1).seconds, 'seconds')
-
-    # Filter by vocab
-    if vocabs:
-        concept_df = concept_df[concept_df.vocabulary_id.isin(vocabs)]
-        concept_ids: Set[str] = set(concept_df.index)
-        concept_rel_df = concept_rel_df[
-            (concept_rel_df.concept_id_1.isin(concept_ids)) |
-            (concept_rel_df.concept_id_2.isin(concept_ids))]
-        t_3 = datetime.now()
-        print('Filtered vocabularies in', (t_3 - t_2).seconds, 'seconds')
     # todo: include automatic addition of these relationships in specific vocabs?
     # if 'RxNorm' in vocabs:
     #     relationships += [x for x in rels if 'rx' in x.lower()]
@@ -416,32 +683,71 @@ def _get_core_objects(
 
     # Filter out singletons
     if exclude_singletons:
-        concepts_with_relations = set(concept_rel_df.concept_id_1) | set(concept_rel_df.concept_id_2)
-        concept_df = concept_df[~concept_df.index.isin(concepts_with_relations)]
+        concept_df = _exclude_singletons(concept_df, _merge_relationship_degrees(*degrees))
+        t_5 = datetime.now()
+        print('Excluded singletons in', (t_5 - t_4b).seconds, 'seconds')
 
     # Cache and return
-    with open(cache_path, 'wb') as f:
-        d = {'concept_df': concept_df, 'rel_maps': rel_maps}
-        pickle.dump(d, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with atomic_output(cache_path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            d = {'concept_df': concept_df, 'rel_maps': rel_maps}
+            pickle.dump(d, f, protocol=pickle.HIGHEST_PROTOCOL)
     return concept_df, rel_maps, cache_path
 
 
+def _count_edges_by_concept(rel_maps: REL_MAPS) -> Dict[CONCEPT_ID, int]:
+    """Count edges of each concept, as subject, across all predicates"""
+    counts: Dict[CONCEPT_ID, int] = {}
+    for rel_map in rel_maps.values():
+        for k, v in rel_map.items():
+            counts[k] = counts.get(k, 0) + len(v)
+    return counts
+
+
+def _create_vocab_outputs(progress: str, *args, **kwargs) -> bool:
+    """Create outputs for a single vocab, reporting progress. See: _create_outputs()"""
+    t_i1 = datetime.now()
+    print(f'Creating outputs {progress} (Java memory: {kwargs["memory"]}G)')
+    using_cached_owl = _create_outputs(*args, **kwargs)
+    t_i2 = datetime.now()
+    print(f' - finished {progress} in {(t_i2 - t_i1).seconds} seconds\n')
+    return using_cached_owl
+
+
 # todo: include semsql in report
 def omop2owl(
     concept_csv_path: str, concept_relationship_csv_path: str, split_by_vocab: bool = True,
     split_by_vocab_merge_after: bool = True, vocabs: List[str] = [],
     relationships: List[str] = ['Is a'], use_cache=False, skip_semsql: bool = False,
-    exclude_singletons: bool = False, memory: int = 100,
+    exclude_singletons: bool = False, memory: int = None,
     ontology_id: str = 'OMOP',  # add str(randint(100000, 999999))?
     outdir: str = os.getcwd(),  # or RELEASE_DIR?
-    retain_general_cache=True, retain_robot_templates=False
+    retain_general_cache=True, retain_robot_templates=False, as_of: Union[str, int] = None,
+    core_objects: Tuple['pd.DataFrame', REL_MAPS] = None, index=False, seed_concepts: List[Union[int, str]] = None,
+    seed_predicates: List[PREDICATE_ID] = ['rdfs:subClassOf'], seed_up_depth: int = -1, seed_down_depth: int = 0,
+    resume=False, workers: int = None
 ) -> Union[Dict[str, Any], None]:
-    """Run the ingest"""
+    """Run the ingest
+
+    :param as_of: Optional date, e.g. '2020-01-01', to create a snapshot of the vocabulary as it was on that date.
+    :param core_objects: Optional concept table and relationship maps that have already been prepared for this output,
+    e.g. by run_batch(). If passed, the input tables are not read.
+    :param index: Also create a lookup index of concepts and relationships. See: omop2owl_vocab.index
+    :param seed_concepts: Optional concept IDs, or paths to files of them, to only create outputs for these concepts
+    and the concepts reached from them via seed_predicates. See: omop2owl_vocab.subset.get_closure()
+    :param resume: Skip stages that a previous run with the same settings completed, as recorded in its checkpoint
+    journal, ONTOLOGY_ID.checkpoints.json. Unlike use_cache, does not reuse outputs that are not in the journal.
+    :param memory: Total memory budget (GB) for Java. Defaults to most of the system's memory. When splitting by
+    vocab, each vocab gets a heap sized by its number of concepts and edges, and vocabs are run concurrently within
+    this budget. See: omop2owl_vocab.scheduler
+    :param workers: Max number of vocabs to create outputs for at once. Defaults to the number of CPUs."""
     # Basic setup
     _cleanup_leftover_semsql_intermediates(outdir)
+    memory = get_memory_budget_gb(memory)
     outdir = outdir if os.path.isabs(outdir) else os.path.join(os.getcwd(), outdir)
     os.makedirs(outdir, exist_ok=True)
-    outpath: str = _get_merged_file_outpath(outdir, ontology_id, vocabs)
+    subset_id = get_subset_id(seed_concepts, seed_predicates, seed_up_depth, seed_down_depth) if seed_concepts else ''
+    outpath: str = _get_merged_file_outpath(outdir, ontology_id, vocabs, _parse_date(as_of), subset_id)
     ontology_iri_pattern = 'http://purl.obolibrary.org/obo/{}/ontology'
     ontology_iri = ontology_iri_pattern.format(ontology_id)
     if isinstance(vocabs, str):
@@ -455,134 +761,140 @@ def omop2owl(
         return
 
     # Run
-    concept_df, rel_maps, cache_path = _get_core_objects(
-        concept_csv_path, concept_relationship_csv_path, outpath, vocabs, relationships, exclude_singletons, use_cache)
-    if not retain_general_cache:
-        os.remove(cache_path)
+    stage = os.path.basename(outpath)
+    checkpoint_settings = {
+        'inputs': [_get_file_signature(x) for x in [concept_csv_path, concept_relationship_csv_path]],
+        'split_by_vocab': split_by_vocab, 'split_by_vocab_merge_after': split_by_vocab_merge_after, 'vocabs': vocabs,
+        'relationships': relationships, 'exclude_singletons': exclude_singletons, 'ontology_id': ontology_id,
+        'as_of': as_of, 'seed_concepts': seed_concepts, 'seed_predicates': seed_predicates,
+        'seed_up_depth': seed_up_depth, 'seed_down_depth': seed_down_depth}
+    checkpoints = Checkpoints(outpath.replace('.owl', '.checkpoints.json'), checkpoint_settings, resume)
+    if core_objects:
+        concept_df, rel_maps = core_objects
+    else:
+        concept_df, rel_maps, cache_path = _get_core_objects(
+            concept_csv_path, concept_relationship_csv_path, outpath, vocabs, relationships, exclude_singletons,
+            use_cache or checkpoints.done('core_objects'), _parse_date(as_of))
+        checkpoints.complete('core_objects', cache_path)
+        if not retain_general_cache:
+            os.remove(cache_path)
+    if seed_concepts:
+        concept_df = subset_concepts(
+            concept_df, rel_maps, seed_concepts, seed_predicates, seed_up_depth, seed_down_depth)
+        print(f'Extracted subset of {len(concept_df)} concepts from seed concepts')
+    index_outpath = outpath.replace('.owl', '.index')
+    index_done = (os.path.exists(index_outpath) and use_cache) or checkpoints.done(os.path.basename(index_outpath))
+    if index and not index_done:
+        print(f'Creating lookup index: {index_outpath}')
+        with atomic_output(index_outpath) as tmp_path:
+            write_index(concept_df, rel_maps, tmp_path)
+        checkpoints.complete(os.path.basename(index_outpath), index_outpath)
     if vocabs or not split_by_vocab:
         _create_outputs(
             concept_df, rel_maps, outpath, ontology_iri, use_cache=use_cache, skip_semsql=skip_semsql, memory=memory,
-            retain_robot_templates=retain_robot_templates)
+            retain_robot_templates=retain_robot_templates, checkpoints=checkpoints)
         return
 
     # - Split by vocab
     # -- Create outputs by vocab
     # todo: put in its own func
+    # -- Vocabs are run concurrently, each with a Java heap sized for it, within the memory budget
     grouped = concept_df.groupby('vocabulary_id')
-    i = 1
     name: str
     vocab_outpaths: List[Path] = []
-    uncached_owl_exists = False
+    vocab_iris: List[str] = []
+    jobs: List[Job] = []
     report = {'vocab_outputs': {}, 'combined_output': {ontology_id: outpath}}
-    for name, group_df in grouped:
+    edge_counts: Dict[CONCEPT_ID, int] = _count_edges_by_concept(rel_maps)
+    for i, (name, group_df) in enumerate(grouped):
         name = name if name else 'Metadata'  # AFAIK, there's just 1 concept "No matching concept" for this
-        t_i1 = datetime.now()
-        print(f'Creating outputs {i} of {len(grouped)}: {name}')
-        vocab_outpath = Path(outdir) / f'{name}.owl'.replace(' ', '-')
+        vocab_outpath = _get_vocab_outpath(outdir, name, ontology_id, _parse_date(as_of), subset_id)
         report['vocab_outputs'][name] = vocab_outpath
         vocab_outpaths.append(vocab_outpath)
-        # noinspection PyBroadException
-        try:
-            ontology_iri_i = f'http://purl.obolibrary.org/obo/{name}/ontology'
-            # todo: The way this is, it makes it maybe look like there is an option in the CLI to allow the user to
-            #  include semsql output when doing all-merged-post-split, but that's not the case.
-            using_cached_owl = _create_outputs(
-                group_df, rel_maps, vocab_outpath, ontology_iri_i, use_cache=use_cache, memory=memory,
-                skip_semsql=True if split_by_vocab_merge_after else skip_semsql,
-                retain_robot_templates=retain_robot_templates)
-            if not using_cached_owl:
-                uncached_owl_exists = True
-        except Exception as err:
-            if os.path.exists(vocab_outpath):
-                os.remove(vocab_outpath)
-            raise err
-        t_i2 = datetime.now()
-        print(f' - finished in {(t_i2 - t_i1).seconds} seconds\n')
-        i += 1
+        ontology_iri_i = f'http://purl.obolibrary.org/obo/{name}/ontology'
+        vocab_iris.append(ontology_iri_i)
+        heap_gb = estimate_heap_gb(len(group_df), sum(edge_counts.get(x, 0) for x in group_df.index), memory)
+        # todo: The way this is, it makes it maybe look like there is an option in the CLI to allow the user to
+        #  include semsql output when doing all-merged-post-split, but that's not the case.
+        jobs.append(Job(name, heap_gb, partial(
+            _create_vocab_outputs, f'{i + 1} of {len(grouped)}: {name}', group_df, rel_maps, vocab_outpath,
+            ontology_iri_i, use_cache=use_cache, memory=heap_gb,
+            skip_semsql=True if split_by_vocab_merge_after else skip_semsql,
+            retain_robot_templates=retain_robot_templates, checkpoints=checkpoints)))
+    print(f'Creating outputs for {len(jobs)} vocabularies, with a memory budget of {memory}G')
+    uncached_owl_exists = not all(run_jobs(jobs, memory, workers))
 
     # -- Merge outputs by vocab
     # todo: put in its own func
     # todo: group annotation props & classes together
     #  - right now the annotation props will get duplicated, and the comment headers for these will also get duplicated.
     #  - classes should be unique though
-    if split_by_vocab_merge_after and (not (os.path.exists(outpath) and use_cache) or uncached_owl_exists):
-        if os.path.exists(outpath):
-            os.remove(outpath)
+    merge_done = ((os.path.exists(outpath) and use_cache) or checkpoints.done(f'{stage}:owl')) \
+        and not uncached_owl_exists
+    if split_by_vocab_merge_after and not merge_done:
         print(f'Joining vocab .owl files into a single OWL: {outpath}')
-        with open(outpath, 'a') as file:
-            for i, path in enumerate(vocab_outpaths):
+        with atomic_output(outpath) as tmp_path, open(tmp_path, 'w') as file:
+            for i, (path, vocab_iri) in enumerate(zip(vocab_outpaths, vocab_iris)):
                 vocab_name = os.path.basename(path).replace(".owl", "")
                 print(f' - {i + 1} of {len(vocab_outpaths)}: {vocab_name}')
                 with open(path) as vocab_file:
-                    try:
-                        original_contents = vocab_file.read()
-                        header, body, footer = _get_header_body_footer(original_contents)
-                        # Header: Do 1x at beginning
-                        if i == 0:
-                            # Fix header & write
-                            header = header.replace(ontology_iri_pattern.format(vocab_name), ontology_iri)
-                            # todo#4b: caused by 'todo#4', changing relationship implementation from annotations /
-                            #  object properties to subclass relation edges worked to get relationships, but somehow
-                            #  when converted to OWL, it does not see any of the 'omoprel' preds, and does not add
-                            #  'omoprel' to the header. I am passing the prefix map explicitly but it's not working.
-                            #  is this a bug in robot?
-                            ns1 = '     xmlns:OMOP="https://athena.ohdsi.org/search-terms/terms/">'
-                            header = header.replace(ns1, f'     xmlns:omoprel="https://w3id.org/cpont/omop/relations/"\n{ns1}')
-                            file.write(header)
-                        # Body
-                        file.write(body)
-                        # Footer: Do 1x at end
-                        if i == len(vocab_outpaths) - 1:
-                            file.write(footer)
-                    except Exception as err:
-                        if os.path.exists(outpath):
-                            os.remove(outpath)
-                        raise err
-
-    if not skip_semsql and not (os.path.exists(outpath.replace('.owl', '.db')) and use_cache):
+                    original_contents = vocab_file.read()
+                    header, body, footer = _get_header_body_footer(original_contents)
+                    # Header: Do 1x at beginning
+                    if i == 0:
+                        # Fix header & write
+                        header = header.replace(vocab_iri, ontology_iri)
+                        # todo#4b: caused by 'todo#4', changing relationship implementation from annotations /
+                        #  object properties to subclass relation edges worked to get relationships, but somehow
+                        #  when converted to OWL, it does not see any of the 'omoprel' preds, and does not add
+                        #  'omoprel' to the header. I am passing the prefix map explicitly but it's not working.
+                        #  is this a bug in robot?
+                        ns1 = '     xmlns:OMOP="https://athena.ohdsi.org/search-terms/terms/">'
+                        header = header.replace(ns1, f'     xmlns:omoprel="https://w3id.org/cpont/omop/relations/"\n{ns1}')
+                        file.write(header)
+                    # Body
+                    file.write(body)
+                    # Footer: Do 1x at end
+                    if i == len(vocab_outpaths) - 1:
+                        file.write(footer)
+        checkpoints.complete(f'{stage}:owl', outpath)
+        checkpoints.invalidate(f'{stage}:semsql')
+
+    semsql_done = (os.path.exists(outpath.replace('.owl', '.db')) and use_cache) or checkpoints.done(f'{stage}:semsql')
+    if not skip_semsql and not semsql_done:
         print(f'Converting to SemanticSQL')
         _convert_semsql(outpath, quiet=True, memory=memory)
+        checkpoints.complete(f'{stage}:semsql', outpath.replace('.owl', '.db'))
     return report
 
 
+def _get_omop2owl_kwargs(d: Dict) -> Dict[str, Any]:
+    """Translate CLI arguments or batch job settings into omop2owl() arguments"""
+    kwargs = {k: d[k] for k in OMOP2OWL_SETTINGS}
+    return kwargs | OUTPUT_TYPE_SETTINGS[d['output_type']]
+
+
 # todo: This really shouldn't exist. Need to refactor to simply improve 'run' so that this is not needed.
 def route_and_run(d: Dict):
     """Translate arguments to determine how to run program."""
-    # TODO: Need to switch to **kwargs for most of below
     if d['install']:
         _run_command('docker pull obolibrary/odkfull:dev')
         print('Installation complete. Exiting.')
         return
+    if d['batch']:
+        from omop2owl_vocab.batch import run_batch
+        run_batch(d['batch'], d)
+        return
     if not d['concept_csv_path'] or not d['concept_relationship_csv_path']:
         raise RuntimeError('Must pass --concept-csv-path and --concept-relationship-csv-path')
     if d['semsql_only']:
-        outpath: str = _get_merged_file_outpath(d['outdir'], d['ontology_id'], d['vocabs'])
-        _convert_semsql(outpath, memory=d['memory'])
-    elif d['output_type'] == 'split':
-        omop2owl(
-            concept_csv_path=d['concept_csv_path'], concept_relationship_csv_path=d['concept_relationship_csv_path'],
-            split_by_vocab=True, use_cache=d['use_cache'], skip_semsql=d['skip_semsql'],
-            exclude_singletons=d['exclude_singletons'], relationships=d['relationships'], vocabs=d['vocabs'],
-            memory=d['memory'], outdir=d['outdir'])
-    elif d['output_type'] == 'merged-post-split':  # Default
-        omop2owl(
-            concept_csv_path=d['concept_csv_path'], concept_relationship_csv_path=d['concept_relationship_csv_path'],
-            split_by_vocab=True, split_by_vocab_merge_after=True, use_cache=d['use_cache'],
-            skip_semsql=d['skip_semsql'], exclude_singletons=d['exclude_singletons'], relationships=d['relationships'],
-            vocabs=d['vocabs'], memory=d['memory'], outdir=d['outdir'])
-    elif d['output_type'] == 'merged':
-        omop2owl(
-            concept_csv_path=d['concept_csv_path'], concept_relationship_csv_path=d['concept_relationship_csv_path'],
-            split_by_vocab=False, use_cache=d['use_cache'], skip_semsql=d['skip_semsql'], memory=d['memory'],
-            exclude_singletons=d['exclude_singletons'], relationships=d['relationships'], vocabs=d['vocabs'],
-            outdir=d['outdir'])
-    elif d['output_type'] == 'rxnorm':
-        # rxnorm_ingest(concept_csv_path=d['concept_csv_path'], concept_relationship_csv_path=d['concept_relationship_csv_path'])
-        omop2owl(
-            concept_csv_path=d['concept_csv_path'], concept_relationship_csv_path=d['concept_relationship_csv_path'],
-            split_by_vocab=True, vocabs=['RxNorm', 'ATC'], use_cache=d['use_cache'],
-            relationships=['Is a', 'Maps to', 'RxNorm inverse is a'], skip_semsql=d['skip_semsql'],
-            exclude_singletons=d['exclude_singletons'], memory=d['memory'], outdir=d['outdir'])
+        subset_id = get_subset_id(d['seed_concepts'], d['seed_predicates'], d['seed_up_depth'], d['seed_down_depth']) \
+            if d['seed_concepts'] else ''
+        outpath: str = _get_merged_file_outpath(
+            d['outdir'], d['ontology_id'], d['vocabs'], _parse_date(d['as_of']), subset_id)
+        _convert_semsql(outpath, memory=get_memory_budget_gb(d['memory']))
+    else:
+        omop2owl(**_get_omop2owl_kwargs(d))
 
 
 def cli_parser(title: str = PROG, description: str = DESC) -> ArgumentParser:
@@ -625,7 +937,14 @@ def cli_parser(title: str = PROG, description: str = DESC) -> ArgumentParser:
              'all-merged-post-split and it is creating initial .owl files to be merged.')
     parser.add_argument(
         '-e', '--exclude-singletons', required=False, action='store_true',
-        help='Exclude terms that do not have any relationships. This only applies to --method robot.')
+        help='Exclude terms that do not have any relationships of the types selected by --relationships.')
+    parser.add_argument(
+        '-a', '--as-of', required=False,
+        help='Create a snapshot of the vocabularies as they were on this date, e.g. 2020-01-01. Only concepts and '
+             'relationships whose valid_start_date and valid_end_date include this date are kept, regardless of their '
+             'current invalid_reason. If --use-cache, the parsed input tables are cached, so that several snapshots '
+             'can be created from a single parse. To do so, pass the same --outdir. Outputs are named after the date, '
+             'e.g. OMOP-as-of-20100101.owl and SNOMED-as-of-20100101.owl.')
     parser.add_argument(
         '-s', '--semsql-only', required=False, action='store_true',
         help='Use this if the .owl already exists and you just want to create a SemanticSQL .db.')
@@ -633,7 +952,48 @@ def cli_parser(title: str = PROG, description: str = DESC) -> ArgumentParser:
         '-C', '--use-cache', required=False, action='store_true',
         help='Of outputs or intermediates already exist, use them.')
     parser.add_argument(
-        '-M', '--memory', required=False, default=100, help='The amount of Java memory (GB) to allocate.')
+        '-u', '--resume', required=False, action='store_true',
+        help='Resume a run that did not finish, e.g. because it ran out of memory, at the first stage it did not '
+             'complete. Completed stages are recorded in ONTOLOGY_ID.checkpoints.json. Unlike --use-cache, outputs '
+             'that the previous run did not record as complete, e.g. if written by a different version or with '
+             'different settings, are recreated.')
+    parser.add_argument(
+        '-M', '--memory', required=False, type=int,
+        help='The total amount of Java memory (GB) to allocate. Defaults to 80%% of the system\'s memory. When creating '
+             'outputs by vocab, each vocab gets a share sized by its number of concepts and edges, and as many vocabs '
+             'as fit within this total are run at once.')
+    parser.add_argument(
+        '-w', '--workers', required=False, type=int,
+        help='The max number of vocabs to create outputs for at once, within --memory. Defaults to the number of '
+             'CPUs. Pass 1 to create them one at a time.')
+    parser.add_argument(
+        '--seed-concepts', required=False, nargs='+',
+        help='Only create outputs for these concepts, and the concepts reached from them via --seed-predicates, e.g. a '
+             'value set and its ancestors. Concept IDs, or paths to files with one concept ID per line. Outputs are '
+             'named after the subset, e.g. OMOP-subset-1a2b3c4d.owl and SNOMED-subset-1a2b3c4d.owl, so as not to '
+             'overwrite outputs of the full ontology. Usage: --seed-concepts 8715 9173 value_set.txt')
+    parser.add_argument(
+        '--seed-predicates', required=False, nargs='+', default=['rdfs:subClassOf'],
+        help='Predicates to walk from --seed-concepts, e.g. rdfs:subClassOf or omoprel:Maps_to. Their relationships '
+             'must be included via --relationships. Passing "ALL" walks all of them. Default is rdfs:subClassOf.')
+    parser.add_argument(
+        '--seed-up-depth', required=False, type=int, default=-1,
+        help='How many steps up --seed-predicates to walk from --seed-concepts, e.g. 1 for parents only. Default is -1, '
+             'for all ancestors.')
+    parser.add_argument(
+        '--seed-down-depth', required=False, type=int, default=0,
+        help='How many steps down --seed-predicates to walk from --seed-concepts, e.g. 1 for children only, or -1 for '
+             'all descendants. Default is 0.')
+    parser.add_argument(
+        '-x', '--index', required=False, action='store_true',
+        help='Also create ONTOLOGY_ID.index, a compact, memory-mappable index for fast lookups of concepts, codes, '
+             'parents, children, and mappings, without loading the .owl or .db. See: omop2owl_vocab.index.OmopIndex')
+    parser.add_argument(
+        '-b', '--batch', required=False,
+        help='Path to a YAML or JSON job file, to create several outputs while only reading the input tables once. '
+             'Top-level keys are settings shared by all jobs, e.g. concept_csv_path, and "jobs" is a list of settings '
+             'for each output, e.g. output_type, vocabs, relationships. Settings use the same names as the long CLI '
+             'options, with underscores. Any other CLI options passed are used as defaults.')
     parser.add_argument('-i', '--install', action='store_true', help='Installs necessary docker images.')
     return parser
 
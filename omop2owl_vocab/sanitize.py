@@ -0,0 +1,35 @@
+"""Sanitize strings for use in XML namespaces, e.g. as predicate local names or in CURIEs
+
+See: https://github.com/HOT-Ecosystem/omop2owl/issues/10
+- allowed: : _ - .
+"""
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+SANITIZE_REPLACEMENTS: Dict[str, str] = {
+    **{x: '_' for x in ' \t\n,|;'},
+    **{x: '.' for x in '/\\'},
+    **{x: '-' for x in '~`!@#$%^*+=?\'"()[]{}<>'},
+}
+SANITIZE_TABLE = str.maketrans(SANITIZE_REPLACEMENTS)
+# SANITIZE_CACHE_SIZE: Bounded, in case sanitize() is fed high-cardinality values, e.g. concept names
+SANITIZE_CACHE_SIZE = 2 ** 16
+
+
+@lru_cache(maxsize=SANITIZE_CACHE_SIZE)
+def sanitize(x: str) -> str:
+    """Sanitize a single string, e.g. an OMOP relationship_id"""
+    return x.translate(SANITIZE_TABLE)
+
+
+def sanitize_series(series: 'pd.Series') -> 'pd.Series':
+    """Sanitize a series of strings in bulk. Expects no null values, e.g. use after .fillna('')."""
+    return series.astype(object).str.translate(SANITIZE_TABLE).astype(object)
+
+
+def sanitize_curie_series(prefix: str, series: 'pd.Series') -> 'pd.Series':
+    """Create a series of CURIEs from a series of local IDs, sanitizing the local IDs in bulk"""
+    return f'{prefix}:' + sanitize_series(series.astype(str))
@@ -0,0 +1,82 @@
+"""Memory-budget-aware scheduling of Java (robot) jobs
+
+Each job, e.g. converting one vocabulary to OWL, gets a Java heap (-Xmx) sized from its number of concepts and edges,
+and jobs are run concurrently as long as the sum of their heaps fits within the total memory budget.
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from math import ceil
+from typing import Any, Callable, Dict, List, NamedTuple, Union
+
+# Defaults
+# - DEFAULT_MEMORY_GB: Used if --memory not passed and system memory can't be detected
+DEFAULT_MEMORY_GB = 100
+# - MEMORY_BUDGET_FRACTION: Fraction of detected system memory to use, leaving the rest for Python & the OS
+MEMORY_BUDGET_FRACTION = 0.8
+# Heap estimates: Rough upper bounds from robot template conversions, so that estimates err on the side of too much
+HEAP_BASE_GB = 1
+HEAP_GB_PER_CONCEPT = 8e-6
+HEAP_GB_PER_EDGE = 2e-6
+
+
+class Job(NamedTuple):
+    """A job to schedule"""
+    name: str
+    heap_gb: int
+    func: Callable[[], Any]
+
+
+def detect_memory_gb() -> Union[int, None]:
+    """Detect total system memory (GB), if possible"""
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024 ** 3)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_memory_budget_gb(memory: Union[int, str, None] = None) -> int:
+    """Get total memory budget (GB): memory if passed, else a fraction of detected system memory"""
+    if memory:
+        return int(memory)
+    detected_gb = detect_memory_gb()
+    return max(1, int(detected_gb * MEMORY_BUDGET_FRACTION)) if detected_gb else DEFAULT_MEMORY_GB
+
+
+def estimate_heap_gb(n_concepts: int, n_edges: int, budget_gb: int) -> int:
+    """Estimate Java heap (GB) needed to convert a set of concepts and their edges to OWL, capped at budget_gb"""
+    estimate = HEAP_BASE_GB + n_concepts * HEAP_GB_PER_CONCEPT + n_edges * HEAP_GB_PER_EDGE
+    return max(1, min(budget_gb, ceil(estimate)))
+
+
+def run_jobs(jobs: List[Job], budget_gb: int, max_workers: int = None) -> List[Any]:
+    """Run jobs concurrently, while keeping the sum of the heaps of running jobs within budget_gb
+
+    Whenever a job finishes, starts as many of the remaining jobs as fit, largest first. A job is always started if
+    nothing else is running, so that jobs with a heap as large as the budget still run, by themselves.
+    :param max_workers: Max number of jobs to run at once. Defaults to number of CPUs.
+    :returns Return values of each job's func, in the same order as jobs"""
+    max_workers = max_workers or os.cpu_count() or 1
+    pending: List[int] = sorted(range(len(jobs)), key=lambda i: -jobs[i].heap_gb)
+    running: Dict[Future, int] = {}
+    results: List[Any] = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            used_gb = sum(jobs[i].heap_gb for i in running.values())
+            for i in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if running and used_gb + jobs[i].heap_gb > budget_gb:
+                    continue
+                running[executor.submit(jobs[i].func)] = i
+                pending.remove(i)
+                used_gb += jobs[i].heap_gb
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                try:
+                    results[i] = future.result()
+                except BaseException:
+                    # Don't start any more jobs. Exiting the executor waits for running ones to finish.
+                    pending.clear()
+                    raise
+    return results
@@ -0,0 +1,94 @@
+"""Subset extraction: the closure of a set of seed concepts, e.g. a value set plus its ancestors"""
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Dict, Iterable, List, Union
+
+from omop2owl_vocab.index import _get_csr, _get_edges
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+
+def read_seed_concepts(seeds: Iterable[Union[int, str]]) -> List[int]:
+    """Read seed concept IDs. Each seed is a concept ID, or a path to a file with one concept ID per line (an optional
+    'concept_id' header line and blank lines are ignored)."""
+    concept_ids: List[int] = []
+    for seed in seeds:
+        if isinstance(seed, str) and os.path.isfile(seed):
+            with open(seed) as f:
+                lines = [x.strip() for x in f.readlines()]
+            concept_ids += [int(x) for x in lines if x and x != 'concept_id']
+        else:
+            concept_ids.append(int(seed))
+    return concept_ids
+
+
+def get_subset_id(
+    seeds: Iterable[Union[int, str]], predicates: List[str] = ['rdfs:subClassOf'], up_depth: int = -1,
+    down_depth: int = 0
+) -> str:
+    """Get a short ID of a subset, from its seed concepts and how they are walked, e.g. to name its outputs"""
+    settings = [sorted(set(read_seed_concepts(seeds))), sorted(predicates), up_depth, down_depth]
+    return hashlib.md5(json.dumps(settings).encode('utf-8')).hexdigest()[:8]
+
+
+def _get_neighbors(indptr: 'np.ndarray', indices: 'np.ndarray', rows: 'np.ndarray') -> 'np.ndarray':
+    """Get neighbors of all rows at once from CSR adjacency"""
+    import numpy as np
+    starts, ends = indptr[rows], indptr[rows + 1]
+    lengths = ends - starts
+    # Position of each neighbor in indices: its row's start, plus its position among the row's neighbors
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return indices[offsets]
+
+
+def get_closure(
+    rel_maps: Dict[str, Dict[str, List[str]]], seeds: Iterable[int], predicates: List[str] = ['rdfs:subClassOf'],
+    up_depth: int = -1, down_depth: int = 0
+) -> 'np.ndarray':
+    """Get closure of seed concepts, by breadth first search over the selected predicates
+
+    "Up" follows edges from subject to object, e.g. from child to parents for rdfs:subClassOf, and "down" follows
+    them from object to subject. Each BFS level processes the whole frontier at once.
+    :param predicates: Predicates to walk. ['ALL'] walks all predicates in rel_maps.
+    :param up_depth: Max number of steps up, e.g. 1 for parents only. -1 for no limit.
+    :param down_depth: Max number of steps down, e.g. 1 for children only. -1 for no limit.
+    :returns Sorted concept IDs of seeds and the concepts reached from them"""
+    import numpy as np
+    seeds = np.unique(np.fromiter(seeds, dtype=np.int64))
+    predicates = list(rel_maps.keys()) if predicates == ['ALL'] else [x for x in predicates if x in rel_maps]
+    edges = [_get_edges(rel_maps[x]) for x in predicates]
+    src = np.concatenate([np.array([], dtype=np.int64)] + [x[0] for x in edges])
+    dst = np.concatenate([np.array([], dtype=np.int64)] + [x[1] for x in edges])
+    ids = np.unique(np.concatenate([seeds, src, dst]))
+    seed_rows = np.searchsorted(ids, seeds)
+
+    visited = np.zeros(len(ids), dtype=bool)
+    visited[seed_rows] = True
+    for edge_src, edge_dst, depth in [(src, dst, up_depth), (dst, src, down_depth)]:
+        indptr, indices = _get_csr(ids, edge_src, edge_dst)
+        indices = np.searchsorted(ids, indices)
+        # Up & down are walked separately, e.g. so that other descendants of ancestors are not included
+        reached = np.zeros(len(ids), dtype=bool)
+        reached[seed_rows] = True
+        frontier = seed_rows
+        level = 0
+        while len(frontier) and level != depth:
+            neighbors = np.unique(_get_neighbors(indptr, indices, frontier))
+            frontier = neighbors[~reached[neighbors]]
+            reached[frontier] = True
+            level += 1
+        visited |= reached
+    return ids[visited]
+
+
+def subset_concepts(
+    concept_df: 'pd.DataFrame', rel_maps: Dict[str, Dict[str, List[str]]], seeds: Iterable[Union[int, str]],
+    predicates: List[str] = ['rdfs:subClassOf'], up_depth: int = -1, down_depth: int = 0
+) -> 'pd.DataFrame':
+    """Filter concept table to the closure of seed concepts. See get_closure()."""
+    import numpy as np
+    closure = get_closure(rel_maps, read_seed_concepts(seeds), predicates, up_depth, down_depth)
+    return concept_df[np.isin(concept_df.index.to_numpy(dtype=np.int64), closure)]
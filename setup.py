@@ -21,6 +21,7 @@ VERSION = '1.3.4'
 REQUIRED = [
     'oaklib>=0.5.20',
     'pandas',
+    'PyYAML',
 ]
 
 # Description
@@ -0,0 +1,322 @@
+"""Benchmarks
+
+Guards against performance regressions. Can run by itself via:
+    python -m unittest test.test_benchmarks
+
+Output benchmarks build outputs of each output type for the test/input fixtures and for a scaled synthetic set, and
+compare their size and class & edge counts against the stored baseline, benchmark_baseline.json. Results of the latest
+run, including generation and downstream load times, are saved to output/benchmarks/results.json. Times depend on the
+machine, so are not in the baseline, but are compared against the previous run's results on the same machine, if any.
+- To record a new baseline, e.g. after an intended change in outputs, set OMOP2OWL_UPDATE_BENCHMARK_BASELINE=1.
+- To change the size of the synthetic set, set OMOP2OWL_BENCHMARK_SCALE, e.g. to 1000000 concepts. Its results are
+  compared against the baseline for that scale, if any.
+- Template benchmarks run omop2owl() with robot stubbed out. OWL benchmarks require Java and robot.jar, and SemanticSQL
+  benchmarks also require Docker. Benchmarks are skipped if these are not available, or if they have no baseline yet.
+"""
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from glob import glob
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Tuple
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from oaklib import get_adapter
+
+from omop2owl_vocab import CONCEPT_DTYPES, CONCEPT_RELATIONSHIP_DTYPES, omop2owl
+from omop2owl_vocab.omop2owl_vocab import DOCKER_PATH, OUTPUT_TYPE_SETTINGS, ROBOT_PATH, ROBOT_SUBHEADER, \
+    _get_merged_file_outpath
+
+TEST_DIR = Path(os.path.abspath(os.path.dirname(__file__)))
+PROJECT_ROOT = TEST_DIR.parent
+TEST_INPUT_DIR = TEST_DIR / 'input'
+BENCHMARK_OUTPUT_DIR = TEST_DIR / 'output' / 'benchmarks'
+BASELINE_PATH = TEST_DIR / 'benchmark_baseline.json'
+RESULTS_PATH = BENCHMARK_OUTPUT_DIR / 'results.json'
+# HEAVY_MODULES: Modules that should only be imported by code paths that actually need them
+HEAVY_MODULES = ['pandas', 'numpy']
+# STARTUP_THRESHOLD_MS: Generous, to avoid flakiness on slow CI machines. Importing pandas alone usually exceeds this.
+STARTUP_THRESHOLD_MS = 200
+OUTPUT_TYPES = ['merged', 'split', 'merged-post-split', 'rxnorm']
+SYNTHETIC_SCALE = int(os.environ.get('OMOP2OWL_BENCHMARK_SCALE', 20_000))
+SYNTHETIC_VOCABS = ['SNOMED', 'RxNorm', 'ATC', 'ICD10CM', 'LOINC']
+UPDATE_BASELINE = bool(os.environ.get('OMOP2OWL_UPDATE_BENCHMARK_BASELINE'))
+# Thresholds: Max increase over baseline before failing. Counts must match the baseline exactly, as outputs are
+# deterministic. Times, compared against the previous run on the same machine, are generous, and have an absolute
+# allowance, to avoid flakiness from machine load.
+SIZE_THRESHOLD = 0.1
+TIME_THRESHOLD = 1.0
+TIME_SLACK_SECONDS = 1.0
+ROBOT_AVAILABLE = os.path.exists(ROBOT_PATH) and bool(shutil.which('java'))
+DOCKER_AVAILABLE = bool(shutil.which(DOCKER_PATH))
+
+
+def _import_times(*args: str) -> Dict[str, int]:
+    """Run Python with `-X importtime` and return cumulative import time (microseconds) of each top-level module"""
+    env = os.environ | {'PYTHONPATH': str(PROJECT_ROOT)}
+    results = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args], capture_output=True, cwd=PROJECT_ROOT, env=env)
+    times: Dict[str, int] = {}
+    for line in results.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self_us, cumulative_us, module = [x.strip() for x in line.replace('import time:', '').split('|')]
+        times[module] = int(cumulative_us)
+    return times
+
+
+class TestStartup(unittest.TestCase):
+    """Startup time of the package and CLI"""
+
+    def _assert_fast_startup(self, *args: str):
+        """Assert that running Python w/ the given args does not import heavy modules and starts up quickly"""
+        times = _import_times(*args)
+        self.assertIn('omop2owl_vocab', times)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, times)
+        self.assertLess(times['omop2owl_vocab'] / 1000, STARTUP_THRESHOLD_MS)
+
+    def test_import_package(self):
+        """Test that importing the package is fast"""
+        self._assert_fast_startup('-c', 'import omop2owl_vocab')
+
+    def test_cli_help(self):
+        """Test that `omop2owl-vocab --help` is fast"""
+        self._assert_fast_startup('-m', 'omop2owl_vocab', '--help')
+
+
+def _write_fixture_inputs(outdir: str) -> Tuple[str, str]:
+    """Combine the test/input fixtures of each vocab into single concept & concept_relationship tables"""
+    concept_path, concept_rel_path = os.path.join(outdir, 'concept.csv'), os.path.join(outdir, 'concept_relationship.csv')
+    vocab_dirs = sorted(TEST_INPUT_DIR.iterdir())
+    pd.concat([pd.read_csv(x / 'concept.csv', dtype=str) for x in vocab_dirs]).to_csv(concept_path, index=False)
+    pd.concat([pd.read_csv(x / 'concept_relationship.csv', dtype=str) for x in vocab_dirs])\
+        .to_csv(concept_rel_path, index=False)
+    return concept_path, concept_rel_path
+
+
+def _write_synthetic_inputs(outdir: str, n_concepts: int, seed: int = 0) -> Tuple[str, str]:
+    """Write synthetic concept & concept_relationship tables, shaped like a small OMOP release
+
+    Each vocab has a hierarchy in which each concept has 1 or 2 parents ('Is a' & 'Subsumes'). RxNorm's hierarchy also
+    has 'RxNorm inverse is a', ICD10CM concepts map to SNOMED ('Maps to'), and some rows are repeated."""
+    rng = np.random.default_rng(seed)
+    n_vocabs = len(SYNTHETIC_VOCABS)
+    ids = np.arange(1, n_concepts + 1)
+    vocabs = np.array(SYNTHETIC_VOCABS)[ids % n_vocabs]
+    concept_df = pd.DataFrame({
+        'concept_id': ids,
+        'concept_name': [f'Synthetic concept {x}' for x in ids],
+        'domain_id': 'Condition',
+        'vocabulary_id': vocabs,
+        'concept_class_id': 'Clinical Finding',
+        'standard_concept': 'S',
+        'concept_code': [f'C{x}' for x in ids],
+        'valid_start_date': '1970-01-01',
+        'valid_end_date': '2099-12-31',
+        'invalid_reason': '',
+    })[list(CONCEPT_DTYPES.keys())]
+
+    # Parents are up to 50 concepts of the same vocab back, so the hierarchy is deep and not just a star
+    children = ids[ids > n_vocabs]
+    max_steps = np.minimum((children - 1) // n_vocabs, 50)
+    edges = [(children, children - rng.integers(1, max_steps + 1) * n_vocabs) for _ in range(2)]
+    edges[1] = (edges[1][0][::2], edges[1][1][::2])
+    child, parent = np.concatenate([x[0] for x in edges]), np.concatenate([x[1] for x in edges])
+    is_rxnorm = vocabs[child - 1] == 'RxNorm'
+    icd10cm, snomed = ids[vocabs == 'ICD10CM'], ids[vocabs == 'SNOMED']
+    concept_rel_df = pd.concat([
+        pd.DataFrame({'concept_id_1': child, 'concept_id_2': parent, 'relationship_id': 'Is a'}),
+        pd.DataFrame({'concept_id_1': parent, 'concept_id_2': child, 'relationship_id': 'Subsumes'}),
+        pd.DataFrame({
+            'concept_id_1': parent[is_rxnorm], 'concept_id_2': child[is_rxnorm],
+            'relationship_id': 'RxNorm inverse is a'}),
+        pd.DataFrame({
+            'concept_id_1': icd10cm, 'concept_id_2': rng.choice(snomed, len(icd10cm)), 'relationship_id': 'Maps to'}),
+    ])
+    concept_rel_df = pd.concat([concept_rel_df, concept_rel_df.sample(frac=0.05, random_state=seed)])\
+        .assign(valid_start_date='1970-01-01', valid_end_date='2099-12-31', invalid_reason='')\
+        [list(CONCEPT_RELATIONSHIP_DTYPES.keys())]
+
+    concept_path, concept_rel_path = os.path.join(outdir, 'concept.csv'), os.path.join(outdir, 'concept_relationship.csv')
+    concept_df.to_csv(concept_path, index=False)
+    concept_rel_df.to_csv(concept_rel_path, index=False)
+    return concept_path, concept_rel_path
+
+
+def _get_settings(output_type: str) -> Dict:
+    """Get omop2owl() settings of output type. Includes all relationships, except where the output type sets them."""
+    return {'relationships': ['ALL'], 'vocabs': []} | OUTPUT_TYPE_SETTINGS[output_type]
+
+
+def _count_template_classes_and_edges(template_paths: List[str]) -> Tuple[int, int]:
+    """Count classes and edges in robot templates"""
+    n_classes, n_edges = 0, 0
+    for path in template_paths:
+        df = pd.read_csv(path, sep='\t', dtype=str, skiprows=[1]).fillna('')
+        rel_cols = [x for x in df.columns if x not in ROBOT_SUBHEADER or x == 'rdfs:subClassOf']
+        n_classes += len(df)
+        n_edges += sum(int(df[x].str.count('OMOP:').sum()) for x in rel_cols)
+    return n_classes, n_edges
+
+
+def _measure_template_counts(outdir: str) -> Dict[str, float]:
+    """Measure size and class & edge counts of the robot templates in outdir"""
+    template_paths = glob(os.path.join(outdir, '*.robot.template.tsv'))
+    n_classes, n_edges = _count_template_classes_and_edges(template_paths)
+    return {'template_bytes': sum(os.path.getsize(x) for x in template_paths), 'classes': n_classes, 'edges': n_edges}
+
+
+def _stub_robot(command: str) -> Tuple[str, str]:
+    """Stand-in for robot, which writes an empty ontology, so that omop2owl() can create templates without Java"""
+    outpath = re.search(r'--output "([^"]+)"', command).group(1)
+    ontology_iri = re.search(r'--ontology-iri "([^"]+)"', command).group(1)
+    with open(outpath, 'w') as f:
+        f.write(f'<?xml version="1.0"?>\n<rdf:RDF>\n    <owl:Ontology rdf:about="{ontology_iri}"/>\n</rdf:RDF>\n')
+    return '', ''
+
+
+def _measure_templates(concept_path: str, concept_rel_path: str, outdir: str, output_type: str) -> Dict[str, float]:
+    """Create robot templates of output type via omop2owl(), with robot stubbed out, and measure them"""
+    t1 = perf_counter()
+    with mock.patch('omop2owl_vocab.omop2owl_vocab._run_command', _stub_robot):
+        omop2owl(
+            concept_path, concept_rel_path, outdir=outdir, skip_semsql=True, retain_robot_templates=True,
+            **_get_settings(output_type))
+    generation_seconds = perf_counter() - t1
+    return _measure_template_counts(outdir) | {'generation_seconds': round(generation_seconds, 3)}
+
+
+def _measure_load(path: str, prefix: str) -> Dict[str, float]:
+    """Load output via oaklib, and measure how long it takes and how many classes & edges it has"""
+    t1 = perf_counter()
+    oi = get_adapter(path)
+    entities = list(oi.entities(filter_obsoletes=False))
+    relationships = list(oi.relationships(subjects=entities))
+    load_seconds = perf_counter() - t1
+    return {
+        f'{prefix}_classes': len(entities),
+        f'{prefix}_edges': len(relationships),
+        f'{prefix}_load_seconds': round(load_seconds, 3),
+    }
+
+
+def _measure_outputs(
+    concept_path: str, concept_rel_path: str, outdir: str, output_type: str, semsql: bool
+) -> Dict[str, float]:
+    """Create outputs of output type, and measure them"""
+    settings = _get_settings(output_type)
+    t1 = perf_counter()
+    omop2owl(
+        concept_path, concept_rel_path, outdir=outdir, skip_semsql=not semsql, retain_robot_templates=True, **settings)
+    generation_seconds = perf_counter() - t1
+    outpath = _get_merged_file_outpath(outdir, 'OMOP', settings['vocabs'])
+    metrics = _measure_template_counts(outdir) | {
+        'owl_bytes': sum(os.path.getsize(x) for x in glob(os.path.join(outdir, '*.owl'))),
+        'generation_seconds': round(generation_seconds, 3),
+    }
+    metrics |= _measure_load(outpath, 'owl')
+    if semsql:
+        db_path = outpath.replace('.owl', '.db')
+        metrics['db_bytes'] = os.path.getsize(db_path)
+        metrics |= _measure_load(db_path, 'db')
+    return metrics
+
+
+def _load_json(path: Path) -> Dict[str, Dict[str, float]]:
+    """Load JSON file, or {} if it does not exist"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _update_json(path: Path, key: str, value: Dict[str, float]):
+    """Set key in JSON file"""
+    d = _load_json(path)
+    d[key] = value
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(dict(sorted(d.items())), f, indent=2)
+        f.write('\n')
+
+
+class TestOutputBenchmarks(unittest.TestCase):
+    """Size, class & edge counts, generation time, and load time of outputs, compared against the stored baseline"""
+    inputs: Dict[str, Tuple[str, str]] = {}
+    tmpdir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        fixture_dir, synthetic_dir = os.path.join(cls.tmpdir.name, 'fixtures'), os.path.join(cls.tmpdir.name, 'synth')
+        os.makedirs(fixture_dir)
+        os.makedirs(synthetic_dir)
+        cls.inputs = {
+            'fixtures': _write_fixture_inputs(fixture_dir),
+            f'synthetic-{SYNTHETIC_SCALE}': _write_synthetic_inputs(synthetic_dir, SYNTHETIC_SCALE),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def _assert_no_regression(self, key: str, metrics: Dict[str, float]):
+        """Assert that metrics did not regress beyond thresholds
+
+        Times are compared against the previous run on this machine, and everything else against the baseline."""
+        previous: Dict[str, float] = _load_json(RESULTS_PATH).get(key, {})
+        _update_json(RESULTS_PATH, key, metrics)
+        times = {k: v for k, v in metrics.items() if k.endswith('_seconds')}
+        for metric, value in times.items():
+            if metric in previous:
+                self.assertLessEqual(
+                    value, previous[metric] * (1 + TIME_THRESHOLD) + TIME_SLACK_SECONDS,
+                    f'{key}: {metric} regressed: {value} vs previous run {previous[metric]}.')
+
+        metrics = {k: v for k, v in metrics.items() if k not in times}
+        if UPDATE_BASELINE:
+            _update_json(BASELINE_PATH, key, metrics)
+            return
+        baseline: Dict[str, float] = _load_json(BASELINE_PATH).get(key, {})
+        if not baseline:
+            self.skipTest(f'No baseline for {key}. To record it, set OMOP2OWL_UPDATE_BENCHMARK_BASELINE=1, and commit '
+                          f'{BASELINE_PATH.name}.')
+        for metric, value in metrics.items():
+            expected = baseline.get(metric)
+            msg = f'{key}: {metric} regressed: {value} vs baseline {expected}. If intended, record a new baseline by ' \
+                f'setting OMOP2OWL_UPDATE_BENCHMARK_BASELINE=1.'
+            self.assertIsNotNone(expected, f'{key}: No baseline for {metric}. To record it, set '
+                                           f'OMOP2OWL_UPDATE_BENCHMARK_BASELINE=1.')
+            if metric.endswith('_bytes'):
+                self.assertLessEqual(value, expected * (1 + SIZE_THRESHOLD), msg)
+            else:
+                self.assertEqual(value, expected, msg)
+
+    def test_templates(self):
+        """Benchmark robot templates, which need neither Java nor Docker"""
+        for dataset, (concept_path, concept_rel_path) in self.inputs.items():
+            for output_type in OUTPUT_TYPES:
+                with self.subTest(dataset=dataset, output_type=output_type), tempfile.TemporaryDirectory() as outdir:
+                    metrics = _measure_templates(concept_path, concept_rel_path, outdir, output_type)
+                    self._assert_no_regression(f'{dataset}/{output_type}/template', metrics)
+
+    @unittest.skipUnless(ROBOT_AVAILABLE, 'Requires Java and robot.jar')
+    def test_outputs(self):
+        """Benchmark OWL outputs, and SemanticSQL outputs if Docker is available"""
+        for dataset, (concept_path, concept_rel_path) in self.inputs.items():
+            for output_type in OUTPUT_TYPES:
+                with self.subTest(dataset=dataset, output_type=output_type), tempfile.TemporaryDirectory() as outdir:
+                    metrics = _measure_outputs(concept_path, concept_rel_path, outdir, output_type, DOCKER_AVAILABLE)
+                    # Every concept in the templates is a class in the output, alongside any properties
+                    self.assertGreaterEqual(metrics['owl_classes'], metrics['classes'])
+                    self._assert_no_regression(
+                        f'{dataset}/{output_type}/{"semsql" if DOCKER_AVAILABLE else "owl"}', metrics)
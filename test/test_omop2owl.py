@@ -3,11 +3,18 @@
 Can run all tests in all files by running this from root of TermHub:
     python -m unittest discover
 """
+import json
 import os
+import re
 import sys
+import tempfile
+import threading
+import time
 import unittest
+from functools import partial
 from pathlib import Path
-from typing import List, Set, Tuple, Union
+from unittest import mock
+from typing import Dict, List, Set, Tuple, Union
 
 import pandas as pd
 from oaklib import BasicOntologyInterface, get_adapter
@@ -23,6 +30,14 @@ TEMP_CONCEPT_REL_CSV = '/Users/joeflack4/projects/TermHub/termhub-csets/datasets
 PROJECT_ROOT = TEST_DIR.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 from omop2owl_vocab import CONCEPT_DTYPES, CONCEPT_RELATIONSHIP_DTYPES, omop2owl
+from omop2owl_vocab.batch import run_batch
+from omop2owl_vocab.checkpoint import Checkpoints, atomic_output
+from omop2owl_vocab.index import OmopIndex, write_index
+from omop2owl_vocab.omop2owl_vocab import _format_dates, _get_core_objects, _get_relationship_degrees, \
+    _get_relationship_maps, _join_object_curies, _merge_relationship_degrees, _parse_date, _parse_dates
+from omop2owl_vocab.sanitize import sanitize, sanitize_curie_series, sanitize_series
+from omop2owl_vocab.scheduler import Job, estimate_heap_gb, get_memory_budget_gb, run_jobs
+from omop2owl_vocab.subset import get_closure, get_subset_id, read_seed_concepts, subset_concepts
 
 
 def _create_test_files(
@@ -130,6 +145,548 @@ class TestOmop2Owl(unittest.TestCase):
         # self.assertGreater(len(rel_set), 1)  # reactivate this when bug fixed / clarified how to get all rels
 
 
+class TestOutputNames(unittest.TestCase):
+    """Tests that runs sharing an output directory don't overwrite or reuse each other's outputs"""
+
+    def test_as_of_snapshots(self):
+        """Test that several snapshots can share an output directory, and so the parse cache"""
+        robot_outputs: List[str] = []
+
+        def run_command(command: str):
+            """Fake robot, recording its outputs"""
+            robot_outputs.append(os.path.basename(re.search(r'--output "([^"]+)"', command).group(1)))
+            return _fake_robot(command)
+
+        for split_by_vocab in [True, False]:
+            with self.subTest(split_by_vocab=split_by_vocab), tempfile.TemporaryDirectory() as tmpdir, \
+                    mock.patch('omop2owl_vocab.omop2owl_vocab._run_command', run_command):
+                robot_outputs.clear()
+                concept_path, concept_rel_path = _write_tiny_inputs(
+                    tmpdir,
+                    [['1'], ['2', 'New concept', 'Condition', 'SNOMED', 'Clinical Finding', 'S', '', '20150101']],
+                    [['2', '1', 'Is a', '20150101']])
+                outdir = os.path.join(tmpdir, 'output')
+                for as_of, n_classes in [('2010-01-01', 1), ('2020-01-01', 2)]:
+                    omop2owl(
+                        concept_path, concept_rel_path, outdir=outdir, as_of=as_of, split_by_vocab=split_by_vocab,
+                        use_cache=True, skip_semsql=True)
+                    with open(os.path.join(outdir, f'OMOP-as-of-{as_of.replace("-", "")}.owl')) as f:
+                        self.assertEqual(len(re.findall('<owl:Class', f.read())), n_classes)
+                self.assertEqual(len(robot_outputs), 2)
+                self.assertEqual(
+                    os.path.exists(os.path.join(outdir, 'SNOMED-as-of-20100101.owl')), split_by_vocab)
+                self.assertEqual(len([x for x in os.listdir(outdir) if 'parse-cache' in x]), 2)
+
+    def test_seed_concepts_subset(self):
+        """Test that a --seed-concepts subset doesn't overwrite or reuse the outputs of the full ontology"""
+        subset_id = get_subset_id([1])
+        for split_by_vocab in [True, False]:
+            with self.subTest(split_by_vocab=split_by_vocab), tempfile.TemporaryDirectory() as tmpdir, \
+                    mock.patch('omop2owl_vocab.omop2owl_vocab._run_command', _fake_robot):
+                concept_path, concept_rel_path = _write_tiny_inputs(tmpdir, [['1'], ['2']], [['2', '1']])
+                outdir = os.path.join(tmpdir, 'output')
+                settings = {'outdir': outdir, 'split_by_vocab': split_by_vocab, 'use_cache': True, 'skip_semsql': True}
+                omop2owl(concept_path, concept_rel_path, **settings)
+                # - As if the full ontology's SemanticSQL output exists, which would skip any run w/ the same outpath
+                Path(outdir, 'OMOP.db').touch()
+                omop2owl(concept_path, concept_rel_path, **settings, seed_concepts=[1])
+                paths = [('OMOP.owl', 2), (f'OMOP-subset-{subset_id}.owl', 1)]
+                if split_by_vocab:
+                    paths += [('SNOMED.owl', 2), (f'SNOMED-subset-{subset_id}.owl', 1)]
+                for path, n_classes in paths:
+                    with open(os.path.join(outdir, path)) as f:
+                        self.assertEqual(len(re.findall('<owl:Class', f.read())), n_classes)
+
+
+class TestSanitize(unittest.TestCase):
+    """Tests for XML namespace sanitization"""
+
+    def test_sanitize(self):
+        """Test sanitizing single strings"""
+        self.assertEqual(sanitize('Is a'), 'Is_a')
+        self.assertEqual(sanitize('Has method (SNOMED)'), 'Has_method_-SNOMED-')
+        self.assertEqual(sanitize('Drug-drug inter/for\\x'), 'Drug-drug_inter.for.x')
+        self.assertEqual(sanitize('a,b|c;d\te\nf'), 'a_b_c_d_e_f')
+        self.assertEqual(sanitize('~`!@#$%^*+=?\'"()[]{}<>'), '-' * 22)
+        self.assertEqual(sanitize('omoprel:Maps_to.value-1'), 'omoprel:Maps_to.value-1')
+
+    def test_sanitize_series(self):
+        """Test that bulk sanitization matches sanitizing one by one"""
+        values = ['Is a', 'Maps to', 'Is a', 'Has method (SNOMED)', '', 'Maps to']
+        series = pd.Series(values, index=[10, 11, 12, 13, 14, 15])
+        sanitized = sanitize_series(series)
+        self.assertEqual(list(sanitized), [sanitize(x) for x in values])
+        self.assertEqual(list(sanitized.index), list(series.index))
+        self.assertEqual(list(sanitize_series(pd.Series([], dtype=str))), [])
+        curies = sanitize_curie_series('omoprel', pd.Series(['Maps to', 'Is a']))
+        self.assertEqual(list(curies), ['omoprel:Maps_to', 'omoprel:Is_a'])
+
+    def test_join_object_curies(self):
+        """Test that the objects of each concept are joined into CURIEs in bulk, in the order of the concepts"""
+        rel_map = {'1': ['2', '3'], '3': ['1']}
+        joined = _join_object_curies(pd.Index(['3', '2', '1']), rel_map)
+        self.assertEqual(list(joined), ['OMOP:1', '', 'OMOP:2|OMOP:3'])
+        self.assertEqual(list(_join_object_curies(pd.Index([]), rel_map)), [])
+
+
+def _write_tiny_inputs(_dir: str, concept_rows: List[List], concept_rel_rows: List[List]) -> Tuple[str, str]:
+    """Write tiny concept & concept_relationship tables. Omitted trailing fields get defaults."""
+    concept_defaults = ['', 'Some concept', 'Condition', 'SNOMED', 'Clinical Finding', 'S', '', '1970-01-01', '2099-12-31', '']
+    concept_rel_defaults = ['', '', 'Is a', '1970-01-01', '2099-12-31', '']
+    concept_path, concept_rel_path = os.path.join(_dir, 'concept.csv'), os.path.join(_dir, 'concept_relationship.csv')
+    pd.DataFrame(
+        [row + concept_defaults[len(row):] for row in concept_rows], columns=list(CONCEPT_DTYPES.keys())
+    ).to_csv(concept_path, index=False)
+    pd.DataFrame(
+        [row + concept_rel_defaults[len(row):] for row in concept_rel_rows],
+        columns=list(CONCEPT_RELATIONSHIP_DTYPES.keys())
+    ).to_csv(concept_rel_path, index=False)
+    return concept_path, concept_rel_path
+
+
+def _fake_robot(command: str) -> Tuple[str, str]:
+    """Fake robot, which converts a template to an OWL file with a class for each of its rows"""
+    outpath = re.search(r'--output "([^"]+)"', command).group(1)
+    template_path = re.search(r'--template "([^"]+)"', command).group(1)
+    ontology_iri = re.search(r'--ontology-iri "([^"]+)"', command).group(1)
+    ids = pd.read_csv(template_path, sep='\t', dtype=str, skiprows=[1])['ID']
+    classes = ''.join(f'    <owl:Class rdf:about="{x}"/>\n' for x in ids)
+    with open(outpath, 'w') as f:
+        f.write(
+            '<?xml version="1.0"?>\n<rdf:RDF xmlns:OMOP="https://athena.ohdsi.org/search-terms/terms/">\n'
+            f'    <owl:Ontology rdf:about="{ontology_iri}"/>\n{classes}</rdf:RDF>\n')
+    return '', ''
+
+
+class TestCoreObjects(unittest.TestCase):
+    """Tests for reading and preparing tables, without converting to OWL"""
+
+    def test_exclude_singletons(self):
+        """Test that singletons are concepts w/ no edges in the selected relationships"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            concept_path, concept_rel_path = _write_tiny_inputs(
+                tmpdir,
+                [['1'], ['2'], ['3'], ['4'], ['5']],
+                [['1', '2', 'Is a'], ['3', '4', 'Maps to'], ['4', '5', 'Is a', '1970-01-01', '2020-01-01', 'D']])
+            outpath = os.path.join(tmpdir, 'OMOP.owl')
+            concept_df, rel_maps, _ = _get_core_objects(
+                concept_path, concept_rel_path, outpath, relationships=['Is a'], exclude_singletons=True)
+            self.assertEqual(sorted(concept_df.index), ['1', '2'])
+            self.assertEqual(rel_maps, {'rdfs:subClassOf': {'1': ['2']}})
+            concept_df, _, _ = _get_core_objects(
+                concept_path, concept_rel_path, outpath, relationships=['ALL'], exclude_singletons=True)
+            self.assertEqual(sorted(concept_df.index), ['1', '2', '3', '4'])
+            concept_df, _, _ = _get_core_objects(concept_path, concept_rel_path, outpath, relationships=['Is a'])
+            self.assertEqual(len(concept_df), 5)
+
+            # Reversed relationships are only used if both concepts are kept
+            concept_path, concept_rel_path = _write_tiny_inputs(
+                tmpdir, [['1', 'Some drug', 'Drug', 'RxNorm'], ['2', 'Some class', 'Drug', 'ATC']],
+                [['1', '2', 'RxNorm inverse is a']])
+            concept_df, rel_maps, _ = _get_core_objects(
+                concept_path, concept_rel_path, outpath, vocabs=['RxNorm'], relationships=['RxNorm inverse is a'],
+                exclude_singletons=True)
+            self.assertEqual(rel_maps, {'rdfs:subClassOf': {}})
+            self.assertEqual(len(concept_df), 0)
+
+    def test_exclude_singletons_chunked(self):
+        """Test that degrees are counted chunk by chunk while reading, with the same result as reading all at once"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            concept_path, concept_rel_path = _write_tiny_inputs(
+                tmpdir,
+                [['1'], ['2'], ['3'], ['4'], ['5'], ['6']],
+                [['1', '2', 'Is a'], ['3', '4', 'Maps to'], ['5', '1', 'Is a'], ['6', '9', 'Is a']])
+            outpath = os.path.join(tmpdir, 'OMOP.owl')
+            for use_cache, n_chunks in [(False, 2), (True, 1), (True, 1)]:
+                with mock.patch('omop2owl_vocab.omop2owl_vocab.CSV_CHUNKSIZE', 2), mock.patch(
+                    'omop2owl_vocab.omop2owl_vocab._get_relationship_degrees', wraps=_get_relationship_degrees
+                ) as get_degrees:
+                    concept_df, _, cache_path = _get_core_objects(
+                        concept_path, concept_rel_path, outpath, relationships=['Is a'], exclude_singletons=True,
+                        use_cache=use_cache)
+                os.remove(cache_path)
+                self.assertEqual(get_degrees.call_count, n_chunks)
+                self.assertEqual(sorted(concept_df.index), ['1', '2', '5', '6'])
+
+    def test_merge_relationship_degrees(self):
+        """Test that degrees counted chunk by chunk equal degrees counted all at once"""
+        concept_rel_df = pd.DataFrame({
+            'concept_id_1': ['1', '2', '2', '7', '9'],
+            'concept_id_2': ['2', '3', '1', '1', '2'],
+            'relationship_id': ['Is a', 'Is a', 'Subsumes', 'Is a', 'Is a'],
+        })
+        concept_ids = {'1', '2', '3', '7'}
+        ids, counts = _get_relationship_degrees(concept_rel_df, ['Is a', 'Subsumes'], concept_ids)
+        chunks = [concept_rel_df.iloc[:2], concept_rel_df.iloc[2:4], concept_rel_df.iloc[4:]]
+        ids2, counts2 = _merge_relationship_degrees(
+            *[_get_relationship_degrees(x, ['Is a', 'Subsumes'], concept_ids) for x in chunks])
+        self.assertEqual(dict(zip(ids.tolist(), counts.tolist())), {1: 3, 2: 3, 3: 1, 7: 1})
+        self.assertEqual(dict(zip(ids2.tolist(), counts2.tolist())), {1: 3, 2: 3, 3: 1, 7: 1})
+
+    def test_canonical_relationship_maps(self):
+        """Test that relationship maps are sorted and deduplicated, regardless of the order of the input rows"""
+        concept_rel_df = pd.DataFrame({
+            'concept_id_1': ['10', '10', '2', '10', '2', '9'],
+            'concept_id_2': ['2', '2', '1', '9', '10', '3'],
+            'relationship_id': ['Is a', 'Is a', 'Is a', 'Is a', 'RxNorm inverse is a', 'RxNorm inverse is a'],
+        })
+        concept_ids = {'1', '2', '3', '9', '10'}
+        relationships = ['Is a', 'RxNorm inverse is a']
+        expected = [('2', ['1']), ('3', ['9']), ('10', ['2', '9'])]
+        for seed in range(3):
+            df = concept_rel_df.sample(frac=1, random_state=seed) if seed else concept_rel_df
+            rel_maps = _get_relationship_maps(df, relationships, concept_ids)
+            self.assertEqual(list(rel_maps['rdfs:subClassOf'].items()), expected)
+
+    def test_dates(self):
+        """Test parsing and formatting of dates"""
+        self.assertEqual(_parse_date('2020-03-13'), 20200313)
+        self.assertEqual(_parse_date('20200313'), 20200313)
+        self.assertEqual(_parse_date(None), 0)
+        parsed = _parse_dates(pd.Series(['2020-03-13', '20991231', '']))
+        self.assertEqual(list(parsed), [20200313, 20991231, 0])
+        self.assertEqual(list(_format_dates(parsed)), ['2020-03-13', '2099-12-31', ''])
+        for invalid in ['2020-3-1', '2020-03-13 00:00:00', '13/03/2020', '20201340', '2020-02-30', '2020-03-1a']:
+            with self.assertRaises(ValueError):
+                _parse_date(invalid)
+        with self.assertRaisesRegex(ValueError, 'valid_end_date'):
+            _parse_dates(pd.Series(['20200101', '13/03/2020'], name='valid_end_date'))
+
+    def test_as_of(self):
+        """Test that --as-of snapshots are the same whether read in chunks or from the parse cache"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            concept_path, concept_rel_path = _write_tiny_inputs(
+                tmpdir,
+                [['1'], ['2'], ['3', 'New concept', 'Condition', 'SNOMED', 'Clinical Finding', 'S', '', '20210101'],
+                 ['4', 'Old concept', 'Condition', 'SNOMED', 'Clinical Finding', '', '', '19700101', '20191231', 'D']],
+                [['1', '2', 'Is a', '1970-01-01', '2018-12-31', 'D'], ['1', '3', 'Is a', '2021-01-01'],
+                 ['2', '4', 'Is a', '1970-01-01', '2019-12-31', 'D'], ['2', '1', 'Is a']])
+            outpath = os.path.join(tmpdir, 'OMOP.owl')
+            expected = {
+                None: (['1', '2', '3', '4'], {'1': ['3'], '2': ['1']}),
+                '2018-06-01': (['1', '2', '4'], {'1': ['2'], '2': ['1', '4']}),
+                '20200101': (['1', '2'], {'2': ['1']}),
+            }
+            for use_cache in [False, True, True]:
+                with mock.patch('omop2owl_vocab.omop2owl_vocab.CSV_CHUNKSIZE', 2):
+                    for as_of, (concept_ids, rel_map) in expected.items():
+                        concept_df, rel_maps, cache_path = _get_core_objects(
+                            concept_path, concept_rel_path, outpath, use_cache=use_cache, as_of=_parse_date(as_of))
+                        os.remove(cache_path)
+                        self.assertEqual(sorted(concept_df.index), concept_ids)
+                        self.assertEqual(rel_maps['rdfs:subClassOf'], rel_map)
+                        self.assertEqual(concept_df.valid_start_date.dtype, 'int32')
+            self.assertEqual(len([x for x in os.listdir(tmpdir) if 'parse-cache' in x]), 2)
+
+
+class TestBatch(unittest.TestCase):
+    """Tests for batch runs"""
+
+    @staticmethod
+    def _run_and_capture(func, *args, **kwargs) -> Dict[str, Tuple[List[str], List[Tuple[str, Dict]]]]:
+        """Run, capturing the concepts & relationships of each output instead of converting to OWL"""
+        captured: Dict[str, Tuple[List[str], List[Tuple[str, Dict]]]] = {}
+
+        def create_outputs(df: pd.DataFrame, rel_maps: Dict, outpath: str, *_args, **_kwargs):
+            """Capture outputs, including every predicate, in order, as each is a column of the robot template"""
+            captured[os.path.basename(outpath)] = (sorted(df.index), [(pred, dict(m)) for pred, m in rel_maps.items()])
+
+        with mock.patch('omop2owl_vocab.omop2owl_vocab._create_outputs', create_outputs):
+            func(*args, **kwargs)
+        return captured
+
+    def test_batch_same_as_individual_runs(self):
+        """Test that a batch creates the same outputs as running each job separately"""
+        concept_path, concept_rel_path = self._prep_inputs()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            jobs = [
+                {'output_type': 'merged'},
+                {'output_type': 'rxnorm'},
+                {'output_type': 'merged', 'vocabs': ['SNOMED', 'ICD10CM'], 'relationships': ['Is a', 'Maps to'],
+                 'exclude_singletons': True},
+                {'output_type': 'merged', 'relationships': 'ALL', 'ontology_id': 'OMOP-all'},
+                {'output_type': 'merged', 'as_of': '2010-01-01', 'ontology_id': 'OMOP-2010'},
+                {'output_type': 'merged', 'vocabs': ['CPT4'], 'relationships': 'ALL'},
+            ]
+            settings = {
+                'concept_csv_path': str(concept_path), 'concept_relationship_csv_path': str(concept_rel_path),
+                'outdir': tmpdir, 'skip_semsql': True}
+            job_file = os.path.join(tmpdir, 'jobs.json')
+            with open(job_file, 'w') as f:
+                json.dump(settings | {'jobs': jobs}, f)
+            batch_outputs = self._run_and_capture(run_batch, job_file)
+
+            individual_outputs = {}
+            for job in jobs:
+                output_type = job.pop('output_type')
+                kwargs = settings | job | {'split_by_vocab': output_type != 'merged'}
+                if output_type == 'rxnorm':
+                    kwargs |= {'vocabs': ['RxNorm', 'ATC'], 'relationships': ['Is a', 'Maps to', 'RxNorm inverse is a']}
+                individual_outputs |= self._run_and_capture(omop2owl, **kwargs)
+
+        self.assertEqual(len(batch_outputs), 6)
+        self.assertTrue(all(rel_map for _pred, rel_map in batch_outputs['OMOP-CPT4.owl'][1]))
+        self.assertEqual(batch_outputs, individual_outputs)
+        self.assertGreater(len(batch_outputs['OMOP-all.owl'][1]), len(batch_outputs['OMOP.owl'][1]))
+
+    def test_batch_same_as_individual_runs_cross_vocab(self):
+        """Test that a batch job of some vocabs doesn't walk edges of other vocabs, in the index or seed closure"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            concept_path, concept_rel_path = _write_tiny_inputs(
+                tmpdir, [[x, f'Concept {x}', 'Condition', vocab] for x, vocab in zip('1234', 'ABAB')],
+                [['1', '2'], ['2', '3'], ['4', '3']])
+            subset_name = f'OMOP-A-A-subset-{get_subset_id([1])}'
+            jobs = [
+                {'output_type': 'merged', 'vocabs': ['A'], 'index': True, 'ontology_id': 'OMOP-A'},
+                {'output_type': 'merged', 'vocabs': ['A'], 'index': True, 'ontology_id': 'OMOP-A',
+                 'seed_concepts': [1]},
+            ]
+            settings = {
+                'concept_csv_path': concept_path, 'concept_relationship_csv_path': concept_rel_path,
+                'skip_semsql': True}
+            job_file = os.path.join(tmpdir, 'jobs.json')
+            with open(job_file, 'w') as f:
+                json.dump(settings | {'outdir': os.path.join(tmpdir, 'batch'), 'jobs': jobs}, f)
+            outputs = {'batch': self._run_and_capture(run_batch, job_file)}
+            outputs['individual'] = {}
+            for job in jobs:
+                kwargs = settings | {k: v for k, v in job.items() if k != 'output_type'}
+                outputs['individual'] |= self._run_and_capture(
+                    omop2owl, **kwargs, outdir=os.path.join(tmpdir, 'individual'), split_by_vocab=False)
+
+            self.assertEqual(outputs['batch'], outputs['individual'])
+            self.assertEqual(outputs['batch'][f'{subset_name}.owl'][0], ['1'])
+            for run in outputs:
+                index = OmopIndex(os.path.join(tmpdir, run, 'OMOP-A-A.index'))
+                self.assertEqual(index.parents(1), [2])
+                self.assertEqual(index.children(3), [])
+                self.assertEqual(len(OmopIndex(os.path.join(tmpdir, run, f'{subset_name}.index'))), 1)
+
+    @staticmethod
+    def _prep_inputs() -> Tuple[Path, Path]:
+        """Combine test inputs"""
+        return TestOmop2Owl._prep_combine_test_subsets()
+
+
+class TestIndex(unittest.TestCase):
+    """Tests for lookup index"""
+
+    def test_index(self):
+        """Test that lookups in index match the concept table and relationship maps it was created from"""
+        concept_path, concept_rel_path = TestOmop2Owl._prep_combine_test_subsets()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            concept_df, rel_maps, _ = _get_core_objects(
+                str(concept_path), str(concept_rel_path), os.path.join(tmpdir, 'OMOP.owl'),
+                relationships=['Is a', 'Maps to'])
+            write_index(concept_df, rel_maps, os.path.join(tmpdir, 'OMOP.index'))
+            index = OmopIndex(os.path.join(tmpdir, 'OMOP.index'))
+
+            self.assertEqual(len(index), len(concept_df))
+            self.assertNotIn(-1, index)
+            self.assertIsNone(index.concept(-1))
+            self.assertIsNone(index.lookup_code('SNOMED', 'not-a-code'))
+            self.assertIsNone(index.lookup_code('Not a vocab', '123'))
+            self.assertEqual(index.parents(-1), [])
+            children: Dict[int, Set[int]] = {}
+            for child, parents in rel_maps['rdfs:subClassOf'].items():
+                for parent in parents:
+                    children.setdefault(int(parent), set()).add(int(child))
+            for row in concept_df.itertuples():
+                concept_id = int(row.Index)
+                self.assertEqual(index.concept(row.Index), {
+                    'concept_id': concept_id, 'concept_name': row.concept_name, 'vocabulary_id': row.vocabulary_id,
+                    'concept_code': row.concept_code})
+                self.assertEqual(index.label(concept_id), row.concept_name)
+                self.assertEqual(index.lookup_code(row.vocabulary_id, row.concept_code), concept_id)
+                self.assertEqual(
+                    index.parents(concept_id),
+                    sorted(int(x) for x in rel_maps['rdfs:subClassOf'].get(row.Index, [])))
+                self.assertEqual(
+                    index.mappings(concept_id), sorted(int(x) for x in rel_maps['omoprel:Maps_to'].get(row.Index, [])))
+                self.assertEqual(set(index.children(concept_id)), children.get(concept_id, set()))
+            self.assertGreater(sum(len(index.parents(x)) for x in concept_df.index), 0)
+
+    def test_index_children(self):
+        """Test reverse lookups, e.g. children"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            concept_path, concept_rel_path = _write_tiny_inputs(
+                tmpdir, [['1'], ['2'], ['3']], [['3', '2', 'Is a'], ['1', '2', 'Is a'], ['2', '4', 'Is a']])
+            concept_df, rel_maps, _ = _get_core_objects(concept_path, concept_rel_path, os.path.join(tmpdir, 'O.owl'))
+            write_index(concept_df, rel_maps, os.path.join(tmpdir, 'O.index'))
+            index = OmopIndex(os.path.join(tmpdir, 'O.index'))
+            self.assertEqual(index.children(2), [1, 3])
+            self.assertEqual(index.parents(2), [4])
+            self.assertEqual(index.children(4), [])
+            self.assertEqual(index.mappings(2), [])
+
+
+class TestSubset(unittest.TestCase):
+    """Tests for subset extraction from seed concepts"""
+    rel_maps = {
+        'rdfs:subClassOf': {'1': ['2'], '2': ['3', '4'], '5': ['2'], '6': ['5'], '7': ['6']},
+        'omoprel:Maps_to': {'1': ['9'], '9': ['10']},
+    }
+
+    def test_get_closure(self):
+        """Test walking up and down from seed concepts"""
+        self.assertEqual(get_closure(self.rel_maps, [1]).tolist(), [1, 2, 3, 4])
+        self.assertEqual(get_closure(self.rel_maps, [1], up_depth=1).tolist(), [1, 2])
+        self.assertEqual(get_closure(self.rel_maps, [2], up_depth=0, down_depth=-1).tolist(), [1, 2, 5, 6, 7])
+        self.assertEqual(get_closure(self.rel_maps, [2], up_depth=0, down_depth=2).tolist(), [1, 2, 5, 6])
+        self.assertEqual(get_closure(self.rel_maps, [5], up_depth=1, down_depth=1).tolist(), [2, 5, 6])
+        self.assertEqual(get_closure(self.rel_maps, [1], ['ALL']).tolist(), [1, 2, 3, 4, 9, 10])
+        self.assertEqual(get_closure(self.rel_maps, [1], ['omoprel:Maps_to'], up_depth=1).tolist(), [1, 9])
+        self.assertEqual(get_closure(self.rel_maps, [99, 3]).tolist(), [3, 99])
+        self.assertEqual(get_closure({}, [1]).tolist(), [1])
+
+    def test_subset_concepts(self):
+        """Test filtering concept table, with seed concepts both passed directly and read from file"""
+        concept_df = pd.DataFrame({'concept_name': [f'concept {x}' for x in range(1, 9)]}, index=[
+            str(x) for x in range(1, 9)])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            seeds_path = os.path.join(tmpdir, 'seeds.txt')
+            with open(seeds_path, 'w') as f:
+                f.write('concept_id\n6\n\n')
+            self.assertEqual(read_seed_concepts(['1', 7, seeds_path]), [1, 7, 6])
+            subset_df = subset_concepts(concept_df, self.rel_maps, [seeds_path, 1], up_depth=1)
+            self.assertEqual(get_subset_id([seeds_path, 1]), get_subset_id(['1', 6, 6]))
+            self.assertNotEqual(get_subset_id([seeds_path, 1]), get_subset_id([seeds_path, 1], up_depth=1))
+        self.assertEqual(list(subset_df.index), ['1', '2', '5', '6'])
+
+
+class TestCheckpoints(unittest.TestCase):
+    """Tests for atomic outputs and resuming runs"""
+
+    def test_atomic_output(self):
+        """Test that a failed write leaves any previous output intact, and no partial output"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'OMOP.owl')
+            with atomic_output(path) as tmp_path:
+                with open(tmp_path, 'w') as f:
+                    f.write('complete')
+            with self.assertRaises(RuntimeError):
+                with atomic_output(path) as tmp_path:
+                    with open(tmp_path, 'w') as f:
+                        f.write('trunc')
+                    raise RuntimeError('Crashed')
+            with open(path) as f:
+                self.assertEqual(f.read(), 'complete')
+            self.assertEqual(os.listdir(tmpdir), ['OMOP.owl'])
+
+    def test_checkpoints(self):
+        """Test that stages are only done if completed with the same settings and their outputs exist"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal_path, output_path = os.path.join(tmpdir, 'journal.json'), os.path.join(tmpdir, 'out.owl')
+            open(output_path, 'w').close()
+            checkpoints = Checkpoints(journal_path, {'vocabs': ['SNOMED']})
+            checkpoints.complete('out', output_path)
+            self.assertTrue(Checkpoints(journal_path, {'vocabs': ['SNOMED']}, resume=True).done('out'))
+            self.assertFalse(Checkpoints(journal_path, {'vocabs': ['RxNorm']}, resume=True).done('out'))
+            checkpoints = Checkpoints(journal_path, {'vocabs': ['SNOMED']})
+            checkpoints.complete('out', output_path)
+            os.remove(output_path)
+            self.assertFalse(Checkpoints(journal_path, {'vocabs': ['SNOMED']}, resume=True).done('out'))
+
+    def test_resume(self):
+        """Test that after a crash, no truncated merged output is left, and --resume only redoes incomplete stages"""
+        concept_path, concept_rel_path = TestOmop2Owl._prep_combine_test_subsets()
+        robot_calls: List[str] = []
+        crash_on = ['RxNorm']
+
+        def run_command(command: str):
+            """Fake robot, which crashes on some vocabs"""
+            outpath = re.search(r'--output "([^"]+)"', command).group(1)
+            ontology_iri = re.search(r'--ontology-iri "([^"]+)"', command).group(1)
+            vocab = os.path.basename(outpath).split('.')[0]
+            if vocab in crash_on:
+                raise RuntimeError('OutOfMemoryError')
+            robot_calls.append(vocab)
+            with open(outpath, 'w') as f:
+                f.write(
+                    '<?xml version="1.0"?>\n<rdf:RDF xmlns:OMOP="https://athena.ohdsi.org/search-terms/terms/">\n'
+                    f'    <owl:Ontology rdf:about="{ontology_iri}"/>\n    <owl:Class rdf:about="{vocab}"/>\n</rdf:RDF>\n')
+            return '', ''
+
+        with tempfile.TemporaryDirectory() as tmpdir, \
+                mock.patch('omop2owl_vocab.omop2owl_vocab._run_command', run_command):
+            settings = {
+                'concept_csv_path': str(concept_path), 'concept_relationship_csv_path': str(concept_rel_path),
+                'outdir': tmpdir, 'skip_semsql': True, 'workers': 1}
+            with self.assertRaises(RuntimeError):
+                omop2owl(**settings)
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, 'OMOP.owl')))
+            self.assertFalse([x for x in os.listdir(tmpdir) if '.tmp.' in x])
+            first_run_calls = list(robot_calls)
+            self.assertEqual(first_run_calls, ['CPT4', 'ICD10CM', 'NDC'])
+
+            crash_on.clear()
+            robot_calls.clear()
+            omop2owl(**settings, resume=True)
+            self.assertEqual(robot_calls, ['RxNorm', 'SNOMED'])
+            with open(os.path.join(tmpdir, 'OMOP.owl')) as f:
+                merged = f.read()
+            self.assertEqual(len(re.findall('<owl:Class', merged)), 5)
+            self.assertTrue(merged.endswith('</rdf:RDF>\n'))
+
+            robot_calls.clear()
+            omop2owl(**settings, resume=True)
+            self.assertEqual(robot_calls, [])
+            omop2owl(**settings)
+            self.assertEqual(len(robot_calls), 5)
+
+
+class TestScheduler(unittest.TestCase):
+    """Tests for memory-budget-aware scheduling"""
+
+    def test_estimate_heap_gb(self):
+        """Test that heap estimates grow with size, and are capped at the budget"""
+        small, large = estimate_heap_gb(50, 100, 64), estimate_heap_gb(1_000_000, 5_000_000, 64)
+        self.assertLessEqual(small, 2)
+        self.assertGreater(large, small)
+        self.assertEqual(estimate_heap_gb(100_000_000, 0, 64), 64)
+        self.assertEqual(get_memory_budget_gb('12'), 12)
+        self.assertGreaterEqual(get_memory_budget_gb(), 1)
+
+    def test_run_jobs(self):
+        """Test that running jobs stay within the budget, and results are in the order of the jobs"""
+        lock = threading.Lock()
+        running: List[int] = []
+        used: List[int] = []
+
+        def job(heap_gb: int, result: str) -> str:
+            """Record memory used while running"""
+            with lock:
+                running.append(heap_gb)
+                used.append(sum(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(heap_gb)
+            return result
+
+        heaps = [2, 6, 1, 3, 5, 10, 1]
+        jobs = [Job(str(i), heap, partial(job, heap, str(i))) for i, heap in enumerate(heaps)]
+        results = run_jobs(jobs, budget_gb=8, max_workers=4)
+        self.assertEqual(results, [str(i) for i in range(len(heaps))])
+        # The 10G job runs by itself, as nothing else fits with it, and the others never exceed the budget together
+        self.assertEqual(max(used), 10)
+        self.assertLessEqual(max(x for x in used if x != 10), 8)
+        self.assertGreater(max(x for x in used if x != 10), max(x for x in heaps if x != 10))  # Some ran at once
+
+    def test_run_jobs_error(self):
+        """Test that an error in a job is raised, and no further jobs are started"""
+        started: List[str] = []
+
+        def job(name: str):
+            """Fail on one job"""
+            started.append(name)
+            if name == 'b':
+                raise RuntimeError('OutOfMemoryError')
+
+        jobs = [Job(x, 1, partial(job, x)) for x in ['a', 'b', 'c', 'd']]
+        with self.assertRaises(RuntimeError):
+            run_jobs(jobs, budget_gb=1)
+        self.assertEqual(started, ['a', 'b'])
+
 # Special debugging: To debug in PyCharm and have it stop at point of error, change TestOmop2Owl(unittest.TestCase)
 #  to TestOmop2Owl, and uncomment below.
 # if __name__ == '__main__':